@@ -0,0 +1,88 @@
+from typing import Dict, List, Tuple
+
+from sqlalchemy import bindparam, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from mappings import AMENITY_GROUPS
+from models import Amenity
+
+# Amenities with an id up to MASK_BITS have a bit in hotels.amenity_mask (signed BIGINT)
+MASK_BITS = 63
+# Removed from the key so "business center", "BusinessCenter" and "business-center" are one amenity
+SEPARATORS = (' ', '-', '_')
+
+
+def amenity_key(name: str) -> str:
+    key = name.lower()
+    for separator in SEPARATORS:
+        key = key.replace(separator, '')
+    return key
+
+
+def key_sql(expression: str) -> str:
+    """SQL twin of amenity_key"""
+    key = f'lower({expression})'
+    for separator in SEPARATORS:
+        key = f"replace({key}, '{separator}', '')"
+    return key
+
+
+def listed_amenities(dialect_name: str, in_hotel_ids: bool = False) -> str:
+    """SELECT of the amenity names listed by the correlated hotels row, or by the hotels in :hotel_ids"""
+    if dialect_name == 'postgresql':
+        def values(group):
+            array = f"hotels.amenities -> '{group}'"
+            return f"jsonb_array_elements_text(CASE WHEN jsonb_typeof({array}) = 'array' THEN {array} ELSE '[]' END) AS value"
+    else:
+        def values(group):
+            return f"json_each(hotels.amenities, '$.{group}')"
+    source, where = ('hotels, ', ' WHERE hotels.id IN :hotel_ids') if in_hotel_ids else ('', '')
+    return ' UNION ALL '.join(f'SELECT value FROM {source}{values(group)}{where}' for group in AMENITY_GROUPS)
+
+
+def register_statement(dialect_name: str) -> str:
+    return f"""
+WITH keyed AS (
+    SELECT {key_sql('value')} AS key, value AS name
+    FROM ({listed_amenities(dialect_name, in_hotel_ids=True)}) listed
+)
+INSERT INTO amenities (key, name)
+SELECT key, min(name)
+FROM keyed
+-- checked first so known amenities do not use up ids of the sequence on Postgres
+WHERE key <> '' AND NOT EXISTS (SELECT 1 FROM amenities WHERE amenities.key = keyed.key)
+GROUP BY key
+-- common amenities get the low ids, the ones with a bit in the mask
+ORDER BY count(*) DESC, key
+ON CONFLICT (key) DO NOTHING
+"""
+
+
+def mask_statement(dialect_name: str) -> str:
+    bits = 'bit_or(CAST(1 AS BIGINT) << (amenities.id - 1))' if dialect_name == 'postgresql' else 'sum(1 << (amenities.id - 1))'
+    return f"""
+UPDATE hotels SET amenity_mask = coalesce((
+    SELECT {bits}
+    FROM amenities
+    WHERE amenities.id <= {MASK_BITS}
+    AND amenities.key IN (SELECT {key_sql('value')} FROM ({listed_amenities(dialect_name)}) listed)
+), 0)
+WHERE hotels.id IN :hotel_ids
+"""
+
+
+async def index_amenities(session: AsyncSession, hotel_ids: List[str]):
+    """Add the amenities of merged hotels to the vocabulary and recompute their amenity_mask"""
+    dialect_name = session.bind.dialect.name
+    for statement in (register_statement(dialect_name), mask_statement(dialect_name)):
+        await session.execute(
+            text(statement).bindparams(bindparam('hotel_ids', expanding=True)),
+            {'hotel_ids': hotel_ids}
+        )
+
+
+async def load_vocabulary(session: AsyncSession, names: List[str]) -> Dict[str, Tuple[int, str]]:
+    """Map the keys of names to their amenity (id, name), unknown names are left out"""
+    keys = {amenity_key(name) for name in names}
+    result = await session.execute(select(Amenity.key, Amenity.id, Amenity.name).where(Amenity.key.in_(keys)))
+    return {key: (id, name) for key, id, name in result}
@@ -1,14 +1,35 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select
-from fastapi import FastAPI, Query, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only, sessionmaker
+from sqlalchemy import and_, exists, false, func, literal, or_, select, text
+from sqlalchemy.dialects.postgresql import JSONB
+from fastapi import FastAPI, Query, Depends, HTTPException, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager
 from itertools import chain
+from urllib.parse import parse_qsl
+from typing import Literal, Tuple
+import base64
+import binascii
+import json
+import logging
+import time
+import zlib
+
+from amenities import MASK_BITS, amenity_key, load_vocabulary
+from cache import TTLCache
+from database import create_engine_for
+from geo import bounding_box, haversine_km
+from mappings import AMENITY_GROUPS
+from search import fts_query, search_query
+from metrics import REGISTRY, REJECTED_DOCUMENTS, REQUEST_SECONDS, label_key
 
 from config import *
 from models import *
 
+logger = logging.getLogger(__name__)
 
-engine = create_async_engine(DATABASE_URL, echo=True, pool_size=2)
+# Read-only engine, every uvicorn worker process creates its own pool on import
+engine = create_engine_for('api')
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 # Dependency: get async DB session
@@ -17,24 +38,428 @@ async def get_session() -> AsyncSession:
         yield session
 
 
-app = FastAPI()
+# Dependency: session factory for streaming responses that outlive the request dependencies
+async def get_session_factory():
+    return AsyncSessionLocal
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WEB_CONCURRENCY > 1:
+        logger.warning("WEB_CONCURRENCY=%d: /metrics only reports the worker that answers each scrape", WEB_CONCURRENCY)
+    yield
+    await engine.dispose()  # close pooled connections when the worker stops
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Query parameters that narrow /hotels, latencies are split by the combination in use
+FILTER_PARAMS = {'hotels', 'destination', 'amenity', 'fields', 'q'}
+
+
+class RequestMetrics:
+    """ASGI middleware observing the latency of every hotel endpoint"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        cache_status = 'none'
+
+        async def send_with_cache_status(message):
+            nonlocal cache_status
+            if message['type'] == 'http.response.start':
+                for name, value in message.get('headers', []):
+                    if name == b'x-cache':
+                        cache_status = value.decode()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cache_status)
+        finally:
+            route = scope.get('route')
+            if route is not None and route.path.startswith('/hotels'):
+                params = {name for name, _ in parse_qsl(scope['query_string'].decode())}
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - start,
+                    endpoint=route.path,
+                    filter='+'.join(sorted(params & FILTER_PARAMS)) or 'none',
+                    cache=cache_status.lower()
+                )
+
+
+app.add_middleware(RequestMetrics)
+
+
+def pool_usage() -> dict:
+    pool = engine.sync_engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {}  # pools without a fixed size (e.g. SQLite tests)
+    return {
+        label_key({'state': 'size'}): pool.size(),
+        label_key({'state': 'checked_out'}): pool.checkedout(),
+        label_key({'state': 'overflow'}): max(pool.overflow(), 0),
+    }
+
+
+REGISTRY.gauge('db_pool_connections', 'Connections of the API database pool', pool_usage)
+
+
+class GenerationTracker:
+    """Polls the merge generation at most once per interval"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.generation = None
+        self.checked_at = 0.0
+
+    async def current(self, session: AsyncSession) -> int:
+        now = time.monotonic()
+        if self.generation is None or now - self.checked_at >= self.interval:
+            result = await session.execute(
+                select(MergeGeneration.generation).where(MergeGeneration.id == 1)
+            )
+            generation = result.scalar() or 0
+            if generation != self.generation:
+                hotels_cache.clear()  # entries of older generations can never be hit again
+            self.generation = generation
+            self.checked_at = now
+        return self.generation
+
+    def reset(self):
+        self.generation = None
+        self.checked_at = 0.0
+
+
+HOTEL_FIELDS = list(HotelSerializer.model_fields)
+
+hotels_cache = TTLCache(maxsize=HOTELS_CACHE_SIZE, ttl=HOTELS_CACHE_TTL)
+generation_tracker = GenerationTracker(interval=MERGE_GENERATION_POLL_INTERVAL)
+
+
+def join_documents(documents: List[bytes]) -> bytes:
+    return b'[' + b','.join(documents) + b']'
+
+
+class JSONArrayResponse(Response):
+    """Sends already serialized JSON documents as a JSON array body"""
+    media_type = 'application/json'
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return join_documents(content)
+
+
+async def load_documents(session: AsyncSession, query) -> List[Tuple[str, Optional[bytes]]]:
+    """Return (id, document) pairs, documents missing from the table are serialized on the fly
+
+    The document is None for rows HotelSerializer rejects, they still count for pagination.
+    """
+    result = await session.execute(query.with_only_columns(Hotel.id, Hotel.document))
+    rows = result.all()
+    missing = [id for id, document in rows if document is None]
+    if missing:
+        result = await session.execute(select(Hotel).where(Hotel.id.in_(missing)))
+        rendered = {hotel.id: render_hotel(hotel) for hotel in result.scalars()}
+        rows = [(id, document if document is not None else rendered.get(id)) for id, document in rows]
+    return [(id, document) for id, document in rows]
+
+
+def valid_documents(rows: List[Tuple[str, Optional[bytes]]]) -> List[Tuple[str, bytes]]:
+    """Leave out the rows HotelSerializer rejects instead of failing the whole page"""
+    rejected = [id for id, document in rows if document is None]
+    if rejected:
+        REJECTED_DOCUMENTS.inc(len(rejected))
+        logger.warning("Hotels left out of the response, rejected by HotelSerializer: %s", ', '.join(rejected))
+    return [(id, document) for id, document in rows if document is not None]
+
+
+async def load_fields(session: AsyncSession, query, fields: List[str]) -> List[Tuple[str, bytes]]:
+    """Return (id, document) pairs holding only the requested fields"""
+    # Unrequested columns are deferred, large images/description payloads stay in the database
+    result = await session.execute(query.options(load_only(*[getattr(Hotel, field) for field in fields])))
+    return [
+        (hotel.id, render_json(document_order({field: getattr(hotel, field) for field in fields})))
+        for hotel in result.scalars()
+    ]
+
+
+def amenity_condition(dialect_name: str, names: List[str]):
+    """Match hotels listing one of the spellings in names in either amenity group"""
+    if dialect_name == 'postgresql':
+        # JSONB containment, served by the GIN index on hotels.amenities
+        return or_(*[
+            Hotel.amenities.op('@>')(literal({group: [name]}, JSONB))
+            for group in AMENITY_GROUPS for name in names
+        ])
+    conditions = []
+    for group in AMENITY_GROUPS:
+        values = func.json_each(Hotel.amenities, f'$.{group}').table_valued('value')
+        conditions.append(exists(select(1).select_from(values).where(values.c.value.in_(names))))
+    return or_(*conditions)
+
+
+def amenities_filter(dialect_name: str, amenities: List[str], vocabulary: Dict[str, Tuple[int, str]], match: str):
+    """Match hotels listing all (or any) of the amenities with one bitwise test on amenity_mask"""
+    bits = 0
+    conditions = []
+    for amenity in amenities:
+        known = vocabulary.get(amenity_key(amenity))
+        if known is None:
+            # Merges index every amenity they see, no hotel lists this one
+            if match == 'all':
+                return false()
+            continue
+        id, name = known
+        if id <= MASK_BITS:
+            bits |= 1 << (id - 1)
+        else:
+            # Past the mask, the requested and the vocabulary spelling are looked up in the JSON instead
+            conditions.append(amenity_condition(dialect_name, sorted({amenity, name})))
+    masked = Hotel.amenity_mask.op('&')(bits)
+    if match == 'any':
+        conditions = ([masked != 0] if bits else []) + conditions
+        return or_(*conditions) if conditions else false()
+    return and_(*([masked == bits] if bits else []), *conditions)
+
+
+def parse_list(values: Optional[List[str]]) -> List[str]:
+    """Accept both repeated and comma separated query parameters"""
+    if not values:
+        return []
+    return sorted(set(chain.from_iterable(value.split(',') for value in values)) - {''})
+
+
+def parse_fields(fields: Optional[List[str]]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = set(parse_list(fields))
+    unknown = requested - set(HOTEL_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.add('id')  # always returned, cursors are built from it
+    return [field for field in HOTEL_FIELDS if field in requested]
+
+
+def encode_cursor(hotel_id: str) -> str:
+    return base64.urlsafe_b64encode(hotel_id.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.b64decode(cursor.encode(), altchars=b'-_', validate=True).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 @app.get("/hotels", response_model=List[HotelSerializer])
 async def get_hotels(
     hotel_ids: Optional[List[str]] = Query(None, alias='hotels'),
     destination_id: Optional[int] = Query(None, alias='destination'),
+    limit: int = Query(HOTELS_PAGE_SIZE, ge=1),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[List[str]] = Query(None),
+    amenities: Optional[List[str]] = Query(None, alias='amenity'),
+    amenity_match: Literal['all', 'any'] = Query('all'),
+    session: AsyncSession = Depends(get_session)
+):
+    limit = min(limit, HOTELS_MAX_PAGE_SIZE)
+    fields = parse_fields(fields)
+    hotel_ids = parse_list(hotel_ids)
+    amenities = [amenity.lower() for amenity in parse_list(amenities)]
+
+    # Cache hits skip the database and Pydantic, merges bump the generation
+    generation = await generation_tracker.current(session)
+    cache_key = (generation, tuple(hotel_ids), destination_id, tuple(amenities), amenity_match, limit, cursor, tuple(fields or ()))
+    cached = hotels_cache.get(cache_key)
+    if cached is None:
+        query = select(Hotel)
+        if hotel_ids:
+            query = query.where(Hotel.id.in_(hotel_ids))
+        if destination_id:
+            query = query.where(Hotel.destination_id == destination_id)
+        if amenities:
+            vocabulary = await load_vocabulary(session, amenities)
+            query = query.where(amenities_filter(session.bind.dialect.name, amenities, vocabulary, amenity_match))
+        # Keyset pagination, deep pages cost the same as the first one
+        if cursor:
+            query = query.where(Hotel.id > decode_cursor(cursor))
+        query = query.order_by(Hotel.id).limit(limit + 1)
+
+        if fields:
+            documents = await load_fields(session, query, fields)
+        else:
+            # Merged hotels carry their serialized document, no Pydantic round trip per row
+            documents = await load_documents(session, query)
+        # The cursor comes from the rows read, a rejected row must not end the pages early
+        next_cursor = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            next_cursor = encode_cursor(documents[-1][0])
+        body = join_documents([document for _, document in valid_documents(documents)])
+        cached = (body, next_cursor)
+        hotels_cache.set(cache_key, cached)
+        cache_status = 'MISS'
+    else:
+        cache_status = 'HIT'
+
+    body, next_cursor = cached
+    headers = {'X-Cache': cache_status}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    return JSONArrayResponse(body, headers=headers)
+
+
+@app.get("/hotels/search", response_model=List[HotelSerializer])
+async def search_hotels(
+    q: str = Query(..., min_length=1),
+    destination_id: Optional[int] = Query(None, alias='destination'),
+    limit: int = Query(HOTELS_PAGE_SIZE, ge=1),
+    cursor: Optional[str] = Query(None),
+    session: AsyncSession = Depends(get_session)
+):
+    limit = min(limit, HOTELS_MAX_PAGE_SIZE)
+    dialect_name = session.bind.dialect.name
+    generation = await generation_tracker.current(session)
+    cache_key = ('search', generation, q, destination_id, limit, cursor)
+    cached = hotels_cache.get(cache_key)
+    if cached is None:
+        rows = []
+        if dialect_name == 'postgresql' or fts_query(q):
+            query, score = search_query(dialect_name, q)
+            if destination_id:
+                query = query.where(Hotel.destination_id == destination_id)
+            # Keyset pagination over (score, id), ties keep a stable order
+            if cursor:
+                try:
+                    last_score, last_id = json.loads(decode_cursor(cursor))
+                except (TypeError, ValueError):
+                    raise HTTPException(status_code=400, detail="Invalid cursor")
+                query = query.where(or_(score > last_score, and_(score == last_score, Hotel.id > last_id)))
+            result = await session.execute(query.order_by(score, Hotel.id).limit(limit + 1))
+            rows = result.all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(json.dumps([rows[-1].score, rows[-1].id]))
+        positions = {row.id: position for position, row in enumerate(rows)}
+        documents = []
+        if positions:
+            documents = valid_documents(await load_documents(session, select(Hotel).where(Hotel.id.in_(positions))))
+        documents.sort(key=lambda row: positions[row[0]])
+        cached = (join_documents([document for _, document in documents]), next_cursor)
+        hotels_cache.set(cache_key, cached)
+        cache_status = 'MISS'
+    else:
+        cache_status = 'HIT'
+
+    body, next_cursor = cached
+    headers = {'X-Cache': cache_status}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    return JSONArrayResponse(body, headers=headers)
+
+
+def with_distance(document: bytes, distance_km: float) -> bytes:
+    # Append the distance to the stored document instead of decoding and re-encoding it
+    return document[:-1] + b',"distance_km":' + render_json(round(distance_km, 3)) + b'}'
+
+
+@app.get("/hotels/nearby", response_model=List[NearbyHotelSerializer])
+async def get_nearby_hotels(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(..., gt=0, le=NEARBY_MAX_RADIUS_KM),
+    limit: int = Query(HOTELS_PAGE_SIZE, ge=1),
     session: AsyncSession = Depends(get_session)
 ):
-    if hotel_ids:
-        hotel_ids = [h.split(',') for h in hotel_ids]
-        hotel_ids = list(chain.from_iterable(hotel_ids))
+    limit = min(limit, HOTELS_MAX_PAGE_SIZE)
+    generation = await generation_tracker.current(session)
+    cache_key = ('nearby', generation, lat, lng, radius_km, limit)
+    body = hotels_cache.get(cache_key)
+    if body is None:
+        # The index on (geocell, lng) narrows the search to a box around the point,
+        # only the coordinates of the candidates are fetched for the exact distance check
+        cells, min_lat, max_lat, lng_ranges = bounding_box(lat, lng, radius_km)
+        query = select(Hotel.id, Hotel.lat, Hotel.lng).where(
+            Hotel.geocell.in_(cells), Hotel.lat.between(min_lat, max_lat)
+        )
+        if lng_ranges:
+            query = query.where(or_(*[Hotel.lng.between(low, high) for low, high in lng_ranges]))
+        result = await session.execute(query)
+        candidates = []
+        for id, hotel_lat, hotel_lng in result:
+            distance = haversine_km(lat, lng, hotel_lat, hotel_lng)
+            if distance <= radius_km:
+                candidates.append((distance, id))
+        candidates.sort()
+        distances = {id: distance for distance, id in candidates[:limit]}
+
+        documents = []
+        if distances:
+            documents = valid_documents(await load_documents(session, select(Hotel).where(Hotel.id.in_(distances))))
+        documents.sort(key=lambda row: (distances[row[0]], row[0]))
+        body = join_documents([with_distance(document, distances[id]) for id, document in documents])
+        hotels_cache.set(cache_key, body)
+        cache_status = 'MISS'
+    else:
+        cache_status = 'HIT'
+    return JSONArrayResponse(body, headers={'X-Cache': cache_status})
 
-    query = select(Hotel)
-    if hotel_ids:
-        query = query.where(Hotel.id.in_(hotel_ids))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return dict(hotels_cache.stats(), generation=generation_tracker.generation)
+
+
+@app.get("/hotels/export")
+async def export_hotels(
+    destination_id: Optional[int] = Query(None, alias='destination'),
+    use_gzip: bool = Query(False, alias='gzip'),
+    session_factory=Depends(get_session_factory)
+):
+    query = select(Hotel.id, Hotel.document).order_by(Hotel.id)
     if destination_id:
         query = query.where(Hotel.destination_id == destination_id)
+    query = query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    async def export_lines():
+        # Server-side cursor, only one batch of rows is held in memory at a time
+        async with session_factory() as session:
+            result = await session.stream(query)
+            async for rows in result.partitions():
+                missing = [id for id, document in rows if document is None]
+                rendered = {}
+                if missing:
+                    async with session_factory() as lookup_session:
+                        hotels = await lookup_session.execute(select(Hotel).where(Hotel.id.in_(missing)))
+                        rendered = {hotel.id: render_hotel(hotel) for hotel in hotels.scalars()}
+                documents = valid_documents([
+                    (id, document if document is not None else rendered.get(id)) for id, document in rows
+                ])
+                yield b''.join(document + b'\n' for _, document in documents)
+
+    async def gzip_lines():
+        compressor = zlib.compressobj(wbits=31)  # gzip container
+        async for chunk in export_lines():
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
 
-    result = await session.execute(query)
-    return result.scalars().all()
+    headers = {'Content-Encoding': 'gzip'} if use_gzip else {}
+    return StreamingResponse(
+        gzip_lines() if use_gzip else export_lines(),
+        media_type='application/x-ndjson',
+        headers=headers
+    )
@@ -0,0 +1,153 @@
+"""Seeded generator of acme/patagonia/paperflies shaped supplier feeds
+
+    python -m benchmarks.generate --hotels 100000 --out benchmarks/data
+"""
+import argparse
+import json
+import os
+import random
+from typing import Dict, Iterator
+
+SOURCES = ['acme', 'patagonia', 'paperflies']
+# Share of the catalog each supplier lists, about a third of the hotels come from all three
+COVERAGE = {'acme': 0.7, 'patagonia': 0.6, 'paperflies': 0.8}
+NULL_RATE = 0.1  # chance of a missing/empty optional field
+HTML_RATE = 0.05  # chance of a text field carrying markup or entities
+
+WORDS = ['grand', 'royal', 'marina', 'bay', 'city', 'garden', 'park', 'palace', 'harbour', 'view',
+         'central', 'river', 'sunset', 'ocean', 'hill', 'boutique', 'heritage', 'urban', 'lagoon', 'plaza']
+AMENITIES = ['wifi', 'pool', 'spa', 'gym', 'parking', 'restaurant', 'bar', 'aircon', 'tv', 'safe',
+             'minibar', 'bathtub', 'kettle', 'hair dryer', 'iron', 'business centre', 'childcare']
+COUNTRIES = ['SG', 'JP', 'FR', 'US', 'VN', 'TH', 'AU', 'GB']
+HTML_NOISE = ['<b>{}</b>', '{} &amp; more', '<p>{}</p>', '{}<script>alert(1)</script>', '<i>{}</i> &quot;']
+
+
+def base_hotel(index: int, seed: int) -> dict:
+    """Canonical facts of a hotel, identical in every feed listing it"""
+    rng = random.Random(seed * 1_000_003 + index)
+    name_words = rng.sample(WORDS, 2)
+    return {
+        'id': f'h{index:07d}',
+        'destination_id': rng.randint(1, 5000),
+        'name': ' '.join(word.title() for word in name_words) + ' Hotel',
+        'description': ' '.join(rng.choices(WORDS, k=rng.randint(20, 60))).capitalize() + '.',
+        'lat': round(rng.uniform(-60, 70), 6),
+        'lng': round(rng.uniform(-180, 180), 6),
+        'address': f'{rng.randint(1, 999)} {rng.choice(WORDS).title()} Street',
+        'city': rng.choice(WORDS).title(),
+        'country': rng.choice(COUNTRIES),
+        'postal_code': f'{rng.randint(0, 999999):06d}',
+        'general': rng.sample(AMENITIES[:9], rng.randint(1, 6)),
+        'room': rng.sample(AMENITIES[7:], rng.randint(1, 5)),
+        'images': [f'https://img.example.com/{index}/{n}.jpg' for n in range(rng.randint(0, 6))],
+    }
+
+
+class Noise:
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+
+    def maybe_null(self, value, empty=None):
+        return empty if self.rng.random() < NULL_RATE else value
+
+    def text(self, value: str) -> str:
+        if self.rng.random() < HTML_RATE:
+            return self.rng.choice(HTML_NOISE).format(value)
+        return value if self.rng.random() > 0.2 else f'  {value} '
+
+
+def acme_record(hotel: dict, noise: Noise) -> dict:
+    return {
+        'Id': hotel['id'],
+        'DestinationId': hotel['destination_id'],
+        'Name': noise.text(hotel['name']),
+        'Latitude': noise.maybe_null(hotel['lat'], ''),
+        'Longitude': noise.maybe_null(hotel['lng'], ''),
+        'Address': noise.maybe_null(noise.text(hotel['address'])),
+        'City': hotel['city'],
+        'Country': hotel['country'],
+        'PostalCode': noise.maybe_null(hotel['postal_code']),
+        'Description': noise.maybe_null(noise.text(hotel['description']), ''),
+        'Facilities': [amenity.title() for amenity in hotel['general']],
+    }
+
+
+def patagonia_record(hotel: dict, noise: Noise) -> dict:
+    return {
+        'id': hotel['id'],
+        'destination': hotel['destination_id'],
+        'name': hotel['name'],
+        'lat': noise.maybe_null(hotel['lat']),
+        'lng': noise.maybe_null(hotel['lng']),
+        'address': noise.maybe_null(hotel['address']),
+        'info': noise.maybe_null(noise.text(hotel['description'])),
+        'amenities': noise.maybe_null(hotel['general'] + hotel['room']),
+        'images': {
+            'rooms': [{'url': url, 'description': 'Room'} for url in hotel['images'][:3]],
+            'amenities': [{'url': url, 'description': 'Amenity'} for url in hotel['images'][3:]],
+        },
+    }
+
+
+def paperflies_record(hotel: dict, noise: Noise) -> dict:
+    return {
+        'hotel_id': hotel['id'],
+        'destination_id': hotel['destination_id'],
+        'hotel_name': noise.text(hotel['name']),
+        'location': {
+            'address': noise.text(hotel['address']),
+            'country': noise.maybe_null(hotel['country']),
+        },
+        'details': noise.text(hotel['description']),
+        'amenities': {'general': hotel['general'], 'room': hotel['room']},
+        'images': {
+            'rooms': [{'link': url, 'caption': 'Double room'} for url in hotel['images'][:2]],
+            'site': [{'link': url, 'caption': 'Front'} for url in hotel['images'][2:]],
+        },
+        'booking_conditions': noise.maybe_null(
+            ['All children are welcome.', 'Pets are not allowed.', 'WiFi is available in all areas.'], []
+        ),
+    }
+
+
+RECORDS = {'acme': acme_record, 'patagonia': patagonia_record, 'paperflies': paperflies_record}
+
+
+def iter_records(source: str, hotels: int, seed: int = 0) -> Iterator[dict]:
+    """Records of one supplier feed, the same seed always gives the same feed"""
+    rng = random.Random(f'{seed}-{source}')
+    noise = Noise(rng)
+    make_record = RECORDS[source]
+    for index in range(hotels):
+        if rng.random() < COVERAGE[source]:
+            yield make_record(base_hotel(index, seed), noise)
+
+
+def write_feeds(out: str, hotels: int, seed: int = 0) -> Dict[str, str]:
+    """Write <out>/<source>.json for every supplier, one record at a time"""
+    os.makedirs(out, exist_ok=True)
+    paths = {}
+    for source in SOURCES:
+        paths[source] = os.path.join(out, f'{source}.json')
+        with open(paths[source], 'w') as f:
+            f.write('[')
+            for position, record in enumerate(iter_records(source, hotels, seed)):
+                if position:
+                    f.write(',')
+                f.write(json.dumps(record))
+            f.write(']')
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hotels', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=os.path.join('benchmarks', 'data'))
+    args = parser.parse_args()
+    for source, path in write_feeds(args.out, args.hotels, args.seed).items():
+        print(f'{source}: {path} ({os.path.getsize(path) / 1e6:.1f} MB)')
+
+
+if __name__ == '__main__':
+    main()
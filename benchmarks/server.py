@@ -0,0 +1,67 @@
+"""Local stand-in for the supplier API, serves generated feeds from a directory
+
+    python -m benchmarks.server --data benchmarks/data --port 8081
+
+Feeds are served at /suppliers/<source> with an ETag, so conditional GETs answer 304.
+"""
+import argparse
+import os
+import shutil
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real supplier API
+
+    def __init__(self, *args, data_dir: str, **kwargs):
+        self.data_dir = data_dir
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        prefix, _, source = self.path.rpartition('/')
+        path = os.path.join(self.data_dir, f'{source}.json')
+        if prefix != '/suppliers' or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        stat = os.stat(path)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(stat.st_size))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, length=1 << 20)
+
+    def log_message(self, format, *args):
+        pass  # one line per request would skew the timings
+
+
+def start_server(data_dir: str, port: int = 0) -> ThreadingHTTPServer:
+    """Serve data_dir in a background thread, port 0 picks a free port"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), partial(FeedHandler, data_dir=data_dir))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', default=os.path.join('benchmarks', 'data'))
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), partial(FeedHandler, data_dir=args.data))
+    print(f'Serving {args.data} at http://127.0.0.1:{args.port}/suppliers/<source>')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
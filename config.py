@@ -9,8 +9,76 @@ DB_NAME = os.getenv("DB_NAME", "hotels")
 
 # SQLAlchemy URL
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or DATABASE_URL  # read replica used by the API
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"  # log every statement
 
 # Pool configuration
 POOL_SIZE = int(os.getenv("POOL_SIZE", "20"))
 MAX_OVERFLOW = int(os.getenv("MAX_OVERFLOW", "30"))
 POOL_TIMEOUT = int(os.getenv("POOL_TIMEOUT", "30"))
+POOL_PRE_PING = os.getenv("POOL_PRE_PING", "true").lower() == "true"  # drop dead connections before use
+POOL_RECYCLE = int(os.getenv("POOL_RECYCLE", "1800"))  # seconds before a connection is replaced
+
+# Engine profiles, POOL_* above are the defaults of both
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", POOL_SIZE))  # per uvicorn worker
+API_MAX_OVERFLOW = int(os.getenv("API_MAX_OVERFLOW", MAX_OVERFLOW))
+API_POOL_TIMEOUT = int(os.getenv("API_POOL_TIMEOUT", POOL_TIMEOUT))
+API_STATEMENT_TIMEOUT = int(os.getenv("API_STATEMENT_TIMEOUT", "5000"))  # milliseconds, 0 disables it
+SCRAPER_POOL_SIZE = int(os.getenv("SCRAPER_POOL_SIZE", "5"))  # sources are ingested concurrently
+SCRAPER_MAX_OVERFLOW = int(os.getenv("SCRAPER_MAX_OVERFLOW", "5"))
+SCRAPER_POOL_TIMEOUT = int(os.getenv("SCRAPER_POOL_TIMEOUT", POOL_TIMEOUT))
+SCRAPER_STATEMENT_TIMEOUT = int(os.getenv("SCRAPER_STATEMENT_TIMEOUT", "0"))  # milliseconds, 0 disables it
+
+# Pipeline configuration
+MERGE_CHUNK_SIZE = int(os.getenv("MERGE_CHUNK_SIZE", "5000"))  # hotel ids merged per round trip
+MERGE_BACKEND = os.getenv("MERGE_BACKEND", "python")  # "sql" merges inside the database with one INSERT ... SELECT per chunk
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000"))  # supplier records flushed per transaction
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "30"))  # days of replaced attribute versions kept by the history compaction
+HISTORY_PARTITIONS_AHEAD = int(os.getenv("HISTORY_PARTITIONS_AHEAD", "7"))  # daily history partitions created in advance on Postgres
+MERGE_QUEUE = os.getenv("MERGE_QUEUE", "false").lower() == "true"  # leave the queued hotel ids to `python worker.py merge` instead of merging them after each run
+MERGE_QUEUE_BATCH_SIZE = int(os.getenv("MERGE_QUEUE_BATCH_SIZE", "1000"))  # hotel ids per queued batch
+MERGE_QUEUE_VISIBILITY_TIMEOUT = float(os.getenv("MERGE_QUEUE_VISIBILITY_TIMEOUT", "300"))  # seconds before a claimed batch can be claimed again
+MERGE_QUEUE_MAX_ATTEMPTS = int(os.getenv("MERGE_QUEUE_MAX_ATTEMPTS", "5"))  # batches failing this often stay in the table for inspection
+MERGE_QUEUE_RETRY_DELAY = float(os.getenv("MERGE_QUEUE_RETRY_DELAY", "5"))  # seconds before a failed batch is retried, doubled per attempt up to the visibility timeout
+MERGE_QUEUE_POLL_INTERVAL = float(os.getenv("MERGE_QUEUE_POLL_INTERVAL", "1"))  # seconds an idle merge worker waits before polling again
+MERGE_LOCK_BUCKETS = int(os.getenv("MERGE_LOCK_BUCKETS", "256"))  # advisory locks hotel ids hash into on Postgres, the most a merge chunk holds
+MERGE_LOCK_NAMESPACE = int(os.getenv("MERGE_LOCK_NAMESPACE", "4242"))  # first key of the merge advisory locks, keeps them apart from other users
+MERGE_WORKERS = int(os.getenv("MERGE_WORKERS", "2"))  # queue consumers per `python worker.py merge` process
+SUPPLIERS_FILE = os.getenv("SUPPLIERS_FILE")  # JSON list of extra supplier mapping specs
+MAPPING_WORKERS = int(os.getenv("MAPPING_WORKERS", "0"))  # processes cleaning and mapping records, 0 disables the pool
+SANITIZE_CACHE_SIZE = int(os.getenv("SANITIZE_CACHE_SIZE", "65536"))  # cleaned short strings kept in the LRU cache
+SANITIZE_CACHE_MAX_LENGTH = int(os.getenv("SANITIZE_CACHE_MAX_LENGTH", "64"))  # longer strings are not cached
+STREAM_FEEDS = os.getenv("STREAM_FEEDS", "false").lower() == "true"  # parse supplier feeds incrementally
+
+# Worker configuration
+SCRAPE_INTERVAL = float(os.getenv("SCRAPE_INTERVAL", "900"))  # seconds between two runs of a source in `python worker.py`
+SCRAPE_INTERVALS = os.getenv("SCRAPE_INTERVALS", "")  # per source overrides, e.g. "acme=300,paperflies=60"
+SCRAPE_JITTER = float(os.getenv("SCRAPE_JITTER", "0.1"))  # fraction of the interval added or removed at random
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))  # sources scraped at the same time
+WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "60"))  # seconds in-flight runs get to finish on SIGTERM
+HISTORY_COMPACT_INTERVAL = float(os.getenv("HISTORY_COMPACT_INTERVAL", "86400"))  # seconds between history compactions in `python worker.py`, 0 disables them
+
+# Supplier HTTP configuration
+CONDITIONAL_GETS = os.getenv("CONDITIONAL_GETS", "true").lower() == "true"  # send the ETag/Last-Modified stored in feed_validators, unchanged feeds answer 304
+HTTP2 = os.getenv("HTTP2", "false").lower() == "true"  # requires the h2 package
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))  # seconds, doubled on every retry
+HTTP_MAX_BACKOFF = float(os.getenv("HTTP_MAX_BACKOFF", "30"))
+SUPPLIER_CONCURRENCY = int(os.getenv("SUPPLIER_CONCURRENCY", "4"))  # in-flight requests per source
+SUPPLIER_RATE_LIMIT = float(os.getenv("SUPPLIER_RATE_LIMIT", "0"))  # requests per second per source, 0 is unlimited
+
+# API configuration
+HOTELS_PAGE_SIZE = int(os.getenv("HOTELS_PAGE_SIZE", "100"))  # default page size of /hotels
+HOTELS_MAX_PAGE_SIZE = int(os.getenv("HOTELS_MAX_PAGE_SIZE", "1000"))  # larger limits are capped
+HOTELS_CACHE_SIZE = int(os.getenv("HOTELS_CACHE_SIZE", "1024"))  # cached /hotels responses, 0 disables the cache
+HOTELS_CACHE_TTL = float(os.getenv("HOTELS_CACHE_TTL", "300"))  # seconds
+MERGE_GENERATION_POLL_INTERVAL = float(os.getenv("MERGE_GENERATION_POLL_INTERVAL", "1"))  # seconds between generation checks
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))  # rows fetched per server-side cursor round trip
+GEOCELL_SIZE = float(os.getenv("GEOCELL_SIZE", "0.1"))  # degrees of latitude per geocell, changing it requires a re-merge
+NEARBY_MAX_RADIUS_KM = float(os.getenv("NEARBY_MAX_RADIUS_KM", "100"))  # largest radius accepted by /hotels/nearby
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))  # uvicorn workers, metrics are per process so keep 1 and scale with replicas
+SEARCH_LANGUAGE = os.getenv("SEARCH_LANGUAGE", "english")  # Postgres text search configuration of hotels.search_vector
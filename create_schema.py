@@ -1,22 +1,23 @@
 import asyncio
 from sqlalchemy import text
-from sqlalchemy.ext.asyncio import create_async_engine
-from config import DATABASE_URL
+from database import create_engine_for
 from models import Base
 
 # Define indexes separately
 INDEXES = [
     "CREATE INDEX IF NOT EXISTS idx_hotels_id ON hotels(id)",
     "CREATE INDEX IF NOT EXISTS idx_hotels_destination_id ON hotels(destination_id)",
-    "CREATE INDEX IF NOT EXISTS idx_hotel_attributes_hotel_id ON hotel_attributes(hotel_id)",
-    "CREATE INDEX IF NOT EXISTS idx_hotel_attributes_source ON hotel_attributes(source)"
+    "CREATE INDEX IF NOT EXISTS idx_hotel_attributes_source ON hotel_attributes(source)",
+    "CREATE INDEX IF NOT EXISTS idx_hotels_amenities ON hotels USING GIN (amenities jsonb_path_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_hotels_geocell_lng ON hotels(geocell, lng)",
+    "CREATE INDEX IF NOT EXISTS idx_hotels_search_vector ON hotels USING GIN (search_vector)"
 ]
 
 async def create_database():
     """Create database schema using SQLAlchemy models"""
     try:
-        # Create async engine
-        engine = create_async_engine(DATABASE_URL, echo=True)
+        # Schema changes go to the primary, like the scraper's writes
+        engine = create_engine_for('scraper')
 
         # Create all tables from models
         async with engine.begin() as conn:
@@ -0,0 +1,49 @@
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.engine import make_url
+
+from config import *
+
+# Engine settings per process type, the API reads from DATABASE_READ_URL and the scraper writes
+ENGINE_PROFILES = {
+    'api': {
+        'url': DATABASE_READ_URL,
+        'pool_size': API_POOL_SIZE,
+        'max_overflow': API_MAX_OVERFLOW,
+        'pool_timeout': API_POOL_TIMEOUT,
+        'statement_timeout': API_STATEMENT_TIMEOUT,
+    },
+    'scraper': {
+        'url': DATABASE_URL,
+        'pool_size': SCRAPER_POOL_SIZE,
+        'max_overflow': SCRAPER_MAX_OVERFLOW,
+        'pool_timeout': SCRAPER_POOL_TIMEOUT,
+        'statement_timeout': SCRAPER_STATEMENT_TIMEOUT,
+    },
+}
+
+
+def engine_options(profile: str) -> dict:
+    """create_async_engine keyword arguments of a profile"""
+    settings = ENGINE_PROFILES[profile]
+    url = make_url(settings['url'])
+    options = {'echo': DB_ECHO}
+    if url.get_backend_name() == 'sqlite':
+        return options  # SQLite picks its own pool, the sizing options do not apply
+    options.update(
+        pool_size=settings['pool_size'],
+        max_overflow=settings['max_overflow'],
+        pool_timeout=settings['pool_timeout'],
+        pool_pre_ping=POOL_PRE_PING,
+        pool_recycle=POOL_RECYCLE,
+    )
+    if url.get_backend_name() == 'postgresql' and url.get_driver_name() == 'asyncpg':
+        # Applied by the server to every statement of the session, a stuck query cannot hold a connection forever
+        server_settings = {'application_name': f'hotels-{profile}'}
+        if settings['statement_timeout']:
+            server_settings['statement_timeout'] = str(settings['statement_timeout'])
+        options['connect_args'] = {'server_settings': server_settings}
+    return options
+
+
+def create_engine_for(profile: str) -> AsyncEngine:
+    return create_async_engine(ENGINE_PROFILES[profile]['url'], **engine_options(profile))
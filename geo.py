@@ -0,0 +1,54 @@
+import math
+from typing import List, Optional, Tuple
+
+from config import *
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def valid_coordinates(lat, lng) -> bool:
+    if not isinstance(lat, (int, float)) or not isinstance(lng, (int, float)):
+        return False
+    return -90 <= lat <= 90 and -180 <= lng <= 180
+
+
+def geocell(lat: Optional[float], lng: Optional[float]) -> Optional[int]:
+    """Latitude band of a point, indexed together with lng it forms a grid over the globe"""
+    if not valid_coordinates(lat, lng):
+        return None
+    return int(math.floor((lat + 90) / GEOCELL_SIZE))
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat: float, lng: float, radius_km: float) -> Tuple[List[int], float, float, Optional[List[Tuple[float, float]]]]:
+    """Return (geocells, min_lat, max_lat, lng ranges) covering every point within radius_km
+
+    lng ranges are None when the box reaches a pole, any longitude can then be within the radius.
+    A box crossing the antimeridian is split into two longitude ranges.
+    """
+    delta_lat = radius_km / KM_PER_DEGREE
+    min_lat = max(-90.0, lat - delta_lat)
+    max_lat = min(90.0, lat + delta_lat)
+    cells = list(range(geocell(min_lat, 0), geocell(max_lat, 0) + 1))
+
+    widest_lat = max(abs(min_lat), abs(max_lat))
+    if widest_lat >= 90:
+        return cells, min_lat, max_lat, None
+    delta_lng = delta_lat / math.cos(math.radians(widest_lat))
+    if delta_lng >= 180:
+        return cells, min_lat, max_lat, None
+    min_lng, max_lng = lng - delta_lng, lng + delta_lng
+    if min_lng < -180:
+        return cells, min_lat, max_lat, [(min_lng + 360, 180.0), (-180.0, max_lng)]
+    if max_lng > 180:
+        return cells, min_lat, max_lat, [(min_lng, 180.0), (-180.0, max_lng - 360)]
+    return cells, min_lat, max_lat, [(min_lng, max_lng)]
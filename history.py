@@ -0,0 +1,92 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import delete, insert, literal, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from config import *
+from database import create_engine_for
+from models import (HISTORY_PARTITION_PREFIX, HotelAttribute, HotelAttributeHistory, day_start, partition_name,
+                    partition_statement)
+
+
+async def archive_attributes(session: AsyncSession, source: str, hotel_ids: List[str], archived_at: datetime):
+    """Copy the current versions of the records about to be replaced into the history table"""
+    if session.bind.dialect.name == 'postgresql':
+        # Created on demand, ingest must not depend on the compaction having run (a no-op once it exists)
+        await session.execute(text(partition_statement(archived_at.astimezone(timezone.utc).date())))
+    versions = select(
+        HotelAttribute.hotel_id,
+        HotelAttribute.source,
+        HotelAttribute.attributes,
+        HotelAttribute.content_hash,
+        HotelAttribute.updated_at,
+        literal(archived_at, HotelAttributeHistory.archived_at.type),
+    ).where(HotelAttribute.source == source, HotelAttribute.hotel_id.in_(hotel_ids))
+    await session.execute(
+        insert(HotelAttributeHistory).from_select(
+            ['hotel_id', 'source', 'attributes', 'content_hash', 'valid_from', 'archived_at'], versions
+        )
+    )
+
+
+async def create_partitions(session: AsyncSession, first_day: date, days: int):
+    """Create the daily partitions of [first_day, first_day + days)"""
+    for offset in range(days):
+        await session.execute(text(partition_statement(first_day + timedelta(days=offset))))
+
+
+async def drop_partitions(engine: AsyncEngine, cutoff: date) -> int:
+    """Detach then drop the daily partitions entirely older than cutoff, without blocking archive inserts"""
+    async with engine.connect() as conn:
+        # DETACH ... CONCURRENTLY cannot run inside a transaction block
+        conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        result = await conn.execute(text(
+            "SELECT child.relname, pg_inherits.inhdetachpending FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = 'hotel_attribute_history'"
+        ))
+        dropped = 0
+        for name, pending in result.all():
+            suffix = name[len(HISTORY_PARTITION_PREFIX):]
+            if not suffix.isdigit() or datetime.strptime(suffix, '%Y%m%d').date() >= cutoff:
+                continue
+            # A detach interrupted half way leaves the partition pending, FINALIZE completes it
+            mode = 'FINALIZE' if pending else 'CONCURRENTLY'
+            await conn.execute(text(f'ALTER TABLE hotel_attribute_history DETACH PARTITION {name} {mode}'))
+            await conn.execute(text(f'DROP TABLE IF EXISTS {name}'))
+            dropped += 1
+        return dropped
+
+
+async def compact_history(session: AsyncSession, retention_days: int = HISTORY_RETENTION_DAYS, today: Optional[date] = None):
+    """Delete versions archived more than retention_days ago, on Postgres by dropping whole partitions"""
+    today = today or datetime.now(timezone.utc).date()
+    cutoff = today - timedelta(days=retention_days)
+    if session.bind.dialect.name == 'postgresql':
+        await create_partitions(session, today, HISTORY_PARTITIONS_AHEAD + 1)
+        # Committed first, an open transaction on the parent would make the concurrent detach wait for it
+        await session.commit()
+        await drop_partitions(session.bind, cutoff)
+    else:
+        await session.execute(
+            delete(HotelAttributeHistory).where(HotelAttributeHistory.archived_at < day_start(cutoff))
+        )
+
+
+async def main():
+    engine = create_engine_for('scraper')
+    try:
+        async with sessionmaker(engine, class_=AsyncSession)() as session:
+            await compact_history(session)
+            await session.commit()
+        print(f"Attribute history compacted, {HISTORY_RETENTION_DAYS} days kept")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
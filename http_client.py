@@ -0,0 +1,179 @@
+import asyncio
+import codecs
+import json
+import random
+import re
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+from config import *
+
+# Statuses worth retrying, anything else is returned to the caller as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+WHITESPACE = re.compile(r'\s*')
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+class RateLimiter:
+    """Spaces out the requests of one source to a fixed rate per second"""
+
+    def __init__(self, rate: float = 0):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class SupplierClient:
+    """Long-lived pooled HTTP client shared by every supplier of a Scraper"""
+
+    def __init__(
+        self,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+        http2: bool = HTTP2,
+        retries: int = HTTP_RETRIES,
+        backoff: float = HTTP_BACKOFF,
+        max_backoff: float = HTTP_MAX_BACKOFF,
+        concurrency: int = SUPPLIER_CONCURRENCY,
+        rate: float = SUPPLIER_RATE_LIMIT,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=connect_timeout,
+            pool=connect_timeout
+        )
+        self.http2 = http2
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.concurrency = concurrency
+        self.rate = rate
+        self.transport = transport
+        self.client: Optional[httpx.AsyncClient] = None
+        self.source_limits: Dict[str, Tuple[asyncio.Semaphore, RateLimiter]] = {}
+
+    def get_client(self) -> httpx.AsyncClient:
+        # Created lazily so building a Scraper never opens connections
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+                transport=self.transport
+            )
+        return self.client
+
+    def configure(self, key: str, concurrency: Optional[int] = None, rate: Optional[float] = None):
+        """Override the concurrency and rate limits of one source"""
+        self.source_limits[key] = (
+            asyncio.Semaphore(concurrency or self.concurrency),
+            RateLimiter(self.rate if rate is None else rate)
+        )
+
+    def limits_for(self, key: str) -> Tuple[asyncio.Semaphore, RateLimiter]:
+        if key not in self.source_limits:
+            self.configure(key)
+        return self.source_limits[key]
+
+    def retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        # Exponential backoff with full jitter, Retry-After wins when the supplier sends it
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(self.max_backoff, float(retry_after)))
+        return delay
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        key: Optional[str] = None,
+        headers: Optional[dict] = None,
+        stream: bool = False
+    ) -> httpx.Response:
+        # With stream=True the body is left unread, the caller must close the response
+        semaphore, rate_limiter = self.limits_for(key or httpx.URL(url).host)
+        client = self.get_client()
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                await rate_limiter.wait()
+                response = None
+                try:
+                    request = client.build_request(method=method, url=url, headers=headers)
+                    response = await client.send(request, stream=stream)
+                except httpx.TransportError:  # timeouts, refused and dropped connections
+                    if attempt == self.retries:
+                        raise
+                else:
+                    if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                        return response
+                    await response.aclose()
+                await asyncio.sleep(self.retry_delay(attempt, response))
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Yield the items of a JSON array while its bytes are still arriving"""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = chunks.__aiter__()
+    buffer = ''
+    started = finished = eof = False
+    while not finished:
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            chunk, eof = b'', True
+        buffer += utf8.decode(chunk, final=eof)
+        pos = 0
+        while True:
+            pos = (SEPARATORS if started else WHITESPACE).match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError("Supplier feed is not a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                finished = True
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                break  # the item is not complete yet
+            if end == len(buffer) and not eof:
+                break  # a number may continue in the next chunk
+            yield item
+            pos = end
+        # Only the unparsed tail is kept between chunks
+        buffer = buffer[pos:]
+        if eof and not finished:
+            raise ValueError("Supplier feed ended before the JSON array was closed")
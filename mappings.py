@@ -0,0 +1,253 @@
+import hashlib
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from config import *
+from sanitize import sanitize_data
+
+# Merged attribute layout, every supplier is mapped onto these fields
+LOCATION_FIELDS = ['lat', 'lng', 'address', 'city', 'country', 'postal_code']
+AMENITY_GROUPS = ['general', 'room']
+IMAGE_GROUPS = ['rooms', 'site', 'amenities']
+
+
+class ImageSpec(BaseModel):
+    path: str = 'images'  # object holding the rooms/site/amenities image lists
+    link: str = 'url'
+    caption: str = 'description'
+
+
+class SupplierSpec(BaseModel):
+    name: str
+    url: str
+    priority: int = 0
+    # Merged attribute path (e.g. "location.lat") -> supplier field path (e.g. "Latitude")
+    fields: Dict[str, str]
+    # Merged attribute path -> name of an extra transform from TRANSFORMS
+    transforms: Dict[str, str] = {}
+    images: Optional[ImageSpec] = None
+
+
+def to_float(value):
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_str(value):
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+
+def to_list(value):
+    return value if isinstance(value, list) else []
+
+
+def to_amenities(value):
+    if not isinstance(value, list):
+        return []
+    return [amenity.lower() for amenity in value if isinstance(amenity, str)]
+
+
+TRANSFORMS: Dict[str, Callable[[Any], Any]] = {
+    'float': to_float,
+    'str': to_str,
+    'list': to_list,
+    'amenities': to_amenities,
+    'lower': lambda value: value.lower() if isinstance(value, str) else value,
+    'title': lambda value: value.title() if isinstance(value, str) else value,
+}
+
+# Transforms applied to every supplier, they mirror the Pydantic serializers in models.py
+DEFAULT_TRANSFORMS = {
+    'location.lat': to_float,
+    'location.lng': to_float,
+    'location.address': to_str,
+    'location.city': to_str,
+    'location.country': to_str,
+    'location.postal_code': to_str,
+    'amenities.general': to_amenities,
+    'amenities.room': to_amenities,
+    'booking_conditions': to_list,
+}
+
+
+def compile_path(path: str) -> Callable[[dict], Any]:
+    """Turn "a.b.c" into a getter that returns None when any key is missing"""
+    keys = path.split('.')
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda record: record.get(key)
+
+    def get(record):
+        for key in keys:
+            if not isinstance(record, dict):
+                return None
+            record = record.get(key)
+        return record
+    return get
+
+
+def compile_field(spec: SupplierSpec, target: str) -> Callable[[dict], Any]:
+    default = DEFAULT_TRANSFORMS.get(target)
+    extra = TRANSFORMS[spec.transforms[target]] if target in spec.transforms else None
+    if target not in spec.fields:
+        # Unmapped fields still go through the default transform to get their empty value
+        transform = default or (lambda value: value)
+        return lambda record: transform(None)
+    get = compile_path(spec.fields[target])
+    if extra and default:
+        return lambda record: default(extra(get(record)))
+    if extra or default:
+        transform = extra or default
+        return lambda record: transform(get(record))
+    return get
+
+
+def compile_images(spec: SupplierSpec) -> Callable[[dict], dict]:
+    if spec.images is None:
+        return lambda record: {group: [] for group in IMAGE_GROUPS}
+    get_images = compile_path(spec.images.path)
+    link_key = spec.images.link
+    caption_key = spec.images.caption
+
+    def images(record):
+        source_images = get_images(record)
+        if not isinstance(source_images, dict):
+            source_images = {}
+        result = {}
+        for group in IMAGE_GROUPS:
+            result[group] = [
+                {'link': image[link_key], 'description': image.get(caption_key) or ""}
+                for image in source_images.get(group) or []
+                if isinstance(image, dict) and image.get(link_key)
+            ]
+        return result
+    return images
+
+
+def compile_spec(spec: SupplierSpec) -> Callable[[dict], dict]:
+    """Compile a supplier spec once into a function mapping one record to merged attributes"""
+    get_id = compile_field(spec, 'id')
+    get_destination_id = compile_field(spec, 'destination_id')
+    get_name = compile_field(spec, 'name')
+    get_description = compile_field(spec, 'description')
+    location_getters = [(field, compile_field(spec, f'location.{field}')) for field in LOCATION_FIELDS]
+    amenity_getters = [(group, compile_field(spec, f'amenities.{group}')) for group in AMENITY_GROUPS]
+    get_images = compile_images(spec)
+    get_booking_conditions = compile_field(spec, 'booking_conditions')
+
+    def mapper(record: dict) -> dict:
+        return {
+            "id": get_id(record),
+            "destination_id": get_destination_id(record),
+            "name": get_name(record),
+            "description": get_description(record),
+            "location": {field: get(record) for field, get in location_getters},
+            "amenities": {group: get(record) for group, get in amenity_getters},
+            "images": get_images(record),
+            "booking_conditions": get_booking_conditions(record)
+        }
+    return mapper
+
+
+# Compiled mappers of the current process, worker processes fill their own copy
+MAPPERS: Dict[str, Callable[[dict], dict]] = {}
+
+
+def get_mapper(spec: SupplierSpec) -> Callable[[dict], dict]:
+    key = spec.model_dump_json()
+    if key not in MAPPERS:
+        MAPPERS[key] = compile_spec(spec)
+    return MAPPERS[key]
+
+
+def content_hash(attributes: dict) -> str:
+    canonical = json.dumps(attributes, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def map_records(spec: SupplierSpec, records: List[dict]) -> List[Tuple[str, str, str]]:
+    """Sanitize, map and serialize supplier records into (hotel_id, attributes JSON, content_hash) rows"""
+    mapper = get_mapper(spec)
+    rows = []
+    for record in records:
+        attributes = mapper(sanitize_data(record))
+        if attributes['id'] is None:
+            continue  # records without an id cannot be merged
+        rows.append((attributes['id'], json.dumps(attributes), content_hash(attributes)))
+    return rows
+
+
+SUPPLIERS: List[SupplierSpec] = [
+    SupplierSpec(
+        name='acme',
+        url='https://5f2be0b4ffc88500167b85a0.mockapi.io/suppliers/acme',
+        priority=0,
+        fields={
+            'id': 'Id',
+            'destination_id': 'DestinationId',
+            'name': 'Name',
+            'description': 'Description',
+            'location.lat': 'Latitude',
+            'location.lng': 'Longitude',
+            'location.address': 'Address',
+            'location.city': 'City',
+            'location.country': 'Country',
+            'location.postal_code': 'PostalCode',
+            'amenities.general': 'Facilities',
+        },
+    ),
+    SupplierSpec(
+        name='patagonia',
+        url='https://5f2be0b4ffc88500167b85a0.mockapi.io/suppliers/patagonia',
+        priority=4,
+        fields={
+            'id': 'id',
+            'destination_id': 'destination',
+            'name': 'name',
+            'description': 'info',
+            'location.lat': 'lat',
+            'location.lng': 'lng',
+            'location.address': 'address',
+            'amenities.general': 'amenities',
+        },
+        images=ImageSpec(link='url', caption='description'),
+    ),
+    SupplierSpec(
+        name='paperflies',
+        url='https://5f2be0b4ffc88500167b85a0.mockapi.io/suppliers/paperflies',
+        priority=6,
+        fields={
+            'id': 'hotel_id',
+            'destination_id': 'destination_id',
+            'name': 'hotel_name',
+            'description': 'details',
+            'location.lat': 'location.lat',
+            'location.lng': 'location.lng',
+            'location.address': 'location.address',
+            'location.country': 'location.country',
+            'amenities.general': 'amenities.general',
+            'amenities.room': 'amenities.room',
+            'booking_conditions': 'booking_conditions',
+        },
+        images=ImageSpec(link='link', caption='caption'),
+    ),
+]
+
+
+def load_suppliers(path: Optional[str] = SUPPLIERS_FILE) -> Dict[str, SupplierSpec]:
+    """Built-in suppliers, extended or overridden by the specs of a JSON file"""
+    suppliers = {spec.name: spec for spec in SUPPLIERS}
+    if path:
+        with open(path) as f:
+            for entry in json.load(f):
+                spec = SupplierSpec(**entry)
+                suppliers[spec.name] = spec
+    return suppliers
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import *
+from metrics import REGISTRY, STAGE_RECORDS
+from models import MergeBatch
+
+logger = logging.getLogger(__name__)
+
+# Batches past MERGE_QUEUE_MAX_ATTEMPTS as last counted by an idle consumer of this process
+parked_batches = {}
+REGISTRY.gauge('merge_queue_parked_batches', 'Merge batches left in the queue after MERGE_QUEUE_MAX_ATTEMPTS failures',
+               lambda: dict(parked_batches))
+
+
+async def enqueue(session: AsyncSession, hotel_ids: List[str], batch_size: int = MERGE_QUEUE_BATCH_SIZE) -> int:
+    """Queue hotel_ids in batches of batch_size, return the number of batches"""
+    # Sorted so workers merging overlapping batches lock shared hotels in the same order
+    hotel_ids = sorted(set(hotel_ids))
+    enqueued_at = datetime.now(timezone.utc)
+    batches = [
+        {'hotel_ids': hotel_ids[start:start + batch_size], 'enqueued_at': enqueued_at, 'attempts': 0}
+        for start in range(0, len(hotel_ids), batch_size)
+    ]
+    if batches:
+        await session.execute(insert(MergeBatch), batches)
+        STAGE_RECORDS.inc(len(hotel_ids), stage='enqueue')
+    return len(batches)
+
+
+async def claim(
+    session: AsyncSession,
+    worker_id: str,
+    visibility_timeout: float = MERGE_QUEUE_VISIBILITY_TIMEOUT,
+    max_attempts: int = MERGE_QUEUE_MAX_ATTEMPTS
+) -> Optional[Tuple[int, List[str]]]:
+    """Claim the oldest batch nobody holds, or whose claim expired, return (id, hotel_ids)"""
+    now = datetime.now(timezone.utc)
+    # SKIP LOCKED: concurrent workers pass over the row being claimed instead of waiting for it
+    candidate = (
+        select(MergeBatch.id)
+        .where(or_(MergeBatch.claimed_at.is_(None), MergeBatch.claimed_at < now - timedelta(seconds=visibility_timeout)))
+        .where(MergeBatch.attempts < max_attempts)
+        .order_by(MergeBatch.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(MergeBatch)
+        .where(MergeBatch.id == candidate)
+        .values(claimed_at=now, claimed_by=worker_id, attempts=MergeBatch.attempts + 1)
+        .returning(MergeBatch.id, MergeBatch.hotel_ids)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.first()
+    await session.commit()  # the claim is visible to other workers before the merge starts
+    return tuple(row) if row else None
+
+
+async def complete(session: AsyncSession, batch_id: int):
+    await session.execute(delete(MergeBatch).where(MergeBatch.id == batch_id))
+    await session.commit()
+
+
+async def release(
+    session: AsyncSession,
+    batch_id: int,
+    retry_delay: float = MERGE_QUEUE_RETRY_DELAY,
+    visibility_timeout: float = MERGE_QUEUE_VISIBILITY_TIMEOUT
+):
+    """Hand a failed batch back after retry_delay, doubled per attempt and capped by the visibility timeout"""
+    batch = await session.get(MergeBatch, batch_id, populate_existing=True)
+    if batch is None:
+        return
+    delay = min(retry_delay * 2 ** max(batch.attempts - 1, 0), visibility_timeout)
+    # claim() takes a batch back once its claim is visibility_timeout old, backdated so that happens after delay
+    batch.claimed_at = datetime.now(timezone.utc) - timedelta(seconds=visibility_timeout - delay)
+    batch.claimed_by = None
+    await session.commit()
+
+
+async def count_parked(
+    session: AsyncSession,
+    visibility_timeout: float = MERGE_QUEUE_VISIBILITY_TIMEOUT,
+    max_attempts: int = MERGE_QUEUE_MAX_ATTEMPTS
+) -> int:
+    """Count the batches no worker will claim again, their last attempt failed or its worker died"""
+    expired = datetime.now(timezone.utc) - timedelta(seconds=visibility_timeout)
+    result = await session.execute(
+        select(func.count()).select_from(MergeBatch)
+        .where(MergeBatch.attempts >= max_attempts)
+        .where(or_(MergeBatch.claimed_by.is_(None), MergeBatch.claimed_at < expired))
+    )
+    return result.scalar_one()
+
+
+async def merge_batch(scraper, batch_id: int, hotel_ids: List[str], retry_delay: float = MERGE_QUEUE_RETRY_DELAY) -> bool:
+    """Merge a claimed batch, delete it once the merge committed or hand it back for a later retry"""
+    try:
+        await scraper.data_merging(hotel_ids)
+    except Exception:
+        logger.exception("Merge of batch %d failed", batch_id)
+        async with scraper.session_factory() as session:
+            await release(session, batch_id, retry_delay=retry_delay)
+        return False
+    # A worker dying before this line leaves the claim to expire, the batch is merged again
+    async with scraper.session_factory() as session:
+        await complete(session, batch_id)
+    return True
+
+
+async def drain(scraper, worker_id: str, retry_delay: float = MERGE_QUEUE_RETRY_DELAY) -> int:
+    """Merge queued batches until none is left to claim, return the number of batches merged"""
+    merged = 0
+    while True:
+        async with scraper.session_factory() as session:
+            claimed = await claim(session, worker_id)
+        if claimed is None:
+            return merged
+        merged += await merge_batch(scraper, *claimed, retry_delay=retry_delay)
+
+
+async def consume(scraper, worker_id: str, stopping: asyncio.Event, poll_interval: float = MERGE_QUEUE_POLL_INTERVAL):
+    """Claim batches and merge them with scraper until stopping is set, a batch being merged is finished first"""
+    while not stopping.is_set():
+        async with scraper.session_factory() as session:
+            claimed = await claim(session, worker_id)
+            if claimed is None:
+                parked_batches[()] = await count_parked(session)
+        if claimed is None:
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await merge_batch(scraper, *claimed, retry_delay=scraper.merge_retry_delay)
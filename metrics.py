@@ -0,0 +1,194 @@
+import inspect
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Seconds, from a cache hit of /hotels up to a full merge chunk
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def label_key(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = [(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(label_key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{format_labels(key)} {format_value(value)}' for key, value in self.values.items()]
+
+    def summary(self) -> dict:
+        return {format_labels(key) or 'total': value for key, value in self.values.items()}
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # labels -> [bucket counts..., sum, count]
+        self.values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = label_key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [0] * (len(self.buckets) + 2)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[position] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, series in self.values.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{format_labels(key, ('le', format_value(bound)))} {count}")
+            lines.append(f'{self.name}_sum{format_labels(key)} {format_value(series[-2])}')
+            lines.append(f'{self.name}_count{format_labels(key)} {series[-1]}')
+        return lines
+
+    def summary(self) -> dict:
+        return {
+            format_labels(key) or 'total': {'count': series[-1], 'seconds': round(series[-2], 6)}
+            for key, series in self.values.items()
+        }
+
+
+class Gauge:
+    """Value read from a callback at collection time"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, collect: Callable[[], Dict[Labels, float]]):
+        self.name = name
+        self.help = help
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{format_labels(key)} {format_value(value)}' for key, value in self.collect().items()]
+
+    def summary(self) -> dict:
+        return {format_labels(key) or 'total': value for key, value in self.collect().items()}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def gauge(self, name: str, help: str, collect: Callable[[], Dict[Labels, float]]) -> Gauge:
+        return self.register(Gauge(name, help, collect))
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict:
+        """Plain dict of every metric with at least one sample"""
+        summary = {}
+        for metric in self.metrics.values():
+            values = metric.summary()
+            if values:
+                summary[metric.name] = values
+        return summary
+
+    def reset(self):
+        for metric in self.metrics.values():
+            if hasattr(metric, 'values'):
+                metric.values.clear()
+
+
+REGISTRY = Registry()
+
+# Pipeline
+STAGE_SECONDS = REGISTRY.histogram('pipeline_stage_seconds', 'Duration of a pipeline stage')
+STAGE_RECORDS = REGISTRY.counter('pipeline_records_total', 'Records processed by a pipeline stage')
+STAGE_ERRORS = REGISTRY.counter('pipeline_errors_total', 'Failed pipeline stages')
+FETCHED_BYTES = REGISTRY.counter('supplier_fetched_bytes_total', 'Bytes downloaded from a supplier')
+SKIPPED_RUNS = REGISTRY.counter('scheduler_skipped_runs_total', 'Scheduled runs skipped because the previous one was still going')
+
+# API
+REQUEST_SECONDS = REGISTRY.histogram('api_request_seconds', 'Latency of the hotel endpoints')
+REJECTED_DOCUMENTS = REGISTRY.counter('api_rejected_documents_total', 'Hotels left out of a response because HotelSerializer rejects them')
+
+
+@contextmanager
+def stage(name: str, **labels):
+    """Time a pipeline stage and count it as failed when it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name, **labels)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name, **labels)
+
+
+def timed(name: str):
+    """Decorate a coroutine as a pipeline stage, labelled with its source argument if any"""
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            source = signature.bind(*args, **kwargs).arguments.get('source')
+            labels = {'source': source} if source is not None else {}
+            with stage(name, **labels):
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,10 +1,20 @@
-from sqlalchemy import Column, Integer, String, JSON, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, Text, JSON, ForeignKey, LargeBinary, Float, DateTime, DDL, Index, UniqueConstraint, event
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import declarative_base
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, ValidationError, validator
 from typing import Any, Dict, Optional, List
+from datetime import date, datetime, timedelta, timezone
+import json
+
+from config import HISTORY_PARTITIONS_AHEAD
 
 Base = declarative_base()
 
+# JSONB on Postgres so the columns can be indexed, generic JSON elsewhere (SQLite tests)
+JSONType = JSON().with_variant(JSONB(), 'postgresql')
+# Only used on Postgres, SQLite searches the hotels_fts table below instead
+TSVectorType = Text().with_variant(TSVECTOR(), 'postgresql')
+
 class Hotel(Base):
     __tablename__ = 'hotels'
 
@@ -12,19 +22,132 @@ class Hotel(Base):
     destination_id = Column(Integer)
     name = Column(String)
     description = Column(String)
-    images = Column(JSON)
-    location = Column(JSON)
-    amenities = Column(JSON)
-    booking_conditions = Column(JSON)
+    images = Column(JSONType)
+    location = Column(JSONType)
+    amenities = Column(JSONType)
+    booking_conditions = Column(JSONType)
+    document = Column(LargeBinary)  # HotelSerializer JSON written by the merge, served as is
+    # Copied out of location by the merge so radius searches can use an index on (geocell, lng)
+    lat = Column(Float)
+    lng = Column(Float)
+    geocell = Column(Integer)
+    search_vector = Column(TSVectorType)  # weighted name/description lexemes, set by the merge
+    amenity_mask = Column(BigInteger, default=0)  # bit id - 1 set for every listed amenity of the vocabulary
+
+
+# SQLite stand-in for search_vector, an FTS5 index over the hotels rows kept in sync by triggers
+for statement in [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS hotels_fts USING fts5(name, description, content='hotels', content_rowid='rowid')",
+    "CREATE TRIGGER IF NOT EXISTS hotels_fts_insert AFTER INSERT ON hotels BEGIN "
+    "INSERT INTO hotels_fts(rowid, name, description) VALUES (new.rowid, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS hotels_fts_delete AFTER DELETE ON hotels BEGIN "
+    "INSERT INTO hotels_fts(hotels_fts, rowid, name, description) VALUES ('delete', old.rowid, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS hotels_fts_update AFTER UPDATE OF name, description ON hotels BEGIN "
+    "INSERT INTO hotels_fts(hotels_fts, rowid, name, description) VALUES ('delete', old.rowid, old.name, old.description); "
+    "INSERT INTO hotels_fts(rowid, name, description) VALUES (new.rowid, new.name, new.description); END",
+]:
+    event.listen(Hotel.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Hotel.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS hotels_fts").execute_if(dialect='sqlite'))
+
+
+class Amenity(Base):
+    __tablename__ = 'amenities'
+    # Vocabulary of the amenities listed by merged hotels, ids are the bits of hotels.amenity_mask
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, unique=True, nullable=False)  # spelling variants share a key, see amenities.amenity_key
+    name = Column(String, nullable=False)  # first spelling registered
 
 
 class HotelAttribute(Base):
     __tablename__ = 'hotel_attributes'
+    # Current state, one row per supplier record updated in place by every scraper run
+    __table_args__ = (UniqueConstraint('hotel_id', 'source', name='uq_hotel_attributes_hotel_id_source'),)
 
     id = Column(Integer, primary_key=True)
     hotel_id = Column(String)
     source = Column(String)
-    attributes = Column(JSON)
+    attributes = Column(JSONType)
+    content_hash = Column(String)  # fingerprint of the mapped attributes
+    updated_at = Column(DateTime(timezone=True))  # when this version was scraped
+
+
+class HotelAttributeHistory(Base):
+    __tablename__ = 'hotel_attribute_history'
+    # Append-only, daily range partitions on Postgres so retention drops whole partitions
+    __table_args__ = (
+        Index('idx_hotel_attribute_history_hotel_id_source', 'hotel_id', 'source'),
+        {'postgresql_partition_by': 'RANGE (archived_at)'},
+    )
+    # No surrogate key, a Postgres primary key would have to include the partition column anyway
+    __mapper_args__ = {'primary_key': ['hotel_id', 'source', 'archived_at']}
+
+    hotel_id = Column(String, nullable=False)
+    source = Column(String, nullable=False)
+    attributes = Column(JSONType)
+    content_hash = Column(String)
+    valid_from = Column(DateTime(timezone=True))  # updated_at of the replaced version
+    archived_at = Column(DateTime(timezone=True), nullable=False)
+
+
+HISTORY_PARTITION_PREFIX = 'hotel_attribute_history_'
+
+
+def partition_name(day: date) -> str:
+    return f'{HISTORY_PARTITION_PREFIX}{day:%Y%m%d}'
+
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc)
+
+
+def partition_statement(day: date) -> str:
+    """CREATE TABLE of the daily history partition holding day"""
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF hotel_attribute_history "
+        f"FOR VALUES FROM ('{day_start(day).isoformat()}') TO ('{day_start(day + timedelta(days=1)).isoformat()}')"
+    )
+
+
+def create_history_partitions(target, connection, **kw):
+    # No default partition, DETACH ... CONCURRENTLY refuses to run next to one. The compaction keeps creating days
+    # ahead and archive_attributes creates a missing day itself
+    if connection.dialect.name != 'postgresql':
+        return
+    today = datetime.now(timezone.utc).date()
+    for offset in range(HISTORY_PARTITIONS_AHEAD + 1):
+        connection.exec_driver_sql(partition_statement(today + timedelta(days=offset)))
+
+
+event.listen(HotelAttributeHistory.__table__, 'after_create', create_history_partitions)
+
+
+class MergeGeneration(Base):
+    __tablename__ = 'merge_generations'
+
+    # Single row bumped by every merge, API caches are keyed on it
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+
+class MergeBatch(Base):
+    __tablename__ = 'merge_queue'
+    # Hotel ids waiting to be merged, claimed by merge workers with FOR UPDATE SKIP LOCKED
+    id = Column(Integer, primary_key=True)
+    hotel_ids = Column(JSONType, nullable=False)
+    enqueued_at = Column(DateTime(timezone=True), nullable=False)
+    claimed_at = Column(DateTime(timezone=True))  # NULL until claimed, an old claim is up for grabs again
+    claimed_by = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+
+
+class FeedValidator(Base):
+    __tablename__ = 'feed_validators'
+    # ETag/Last-Modified of the last supplier feed ingested, stored once its records and pending merges committed
+    url = Column(String, primary_key=True)
+    etag = Column(String)
+    last_modified = Column(String)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
 
 
 class ImageNestedSerializer(BaseModel):
@@ -74,3 +197,42 @@ class HotelSerializer(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class NearbyHotelSerializer(HotelSerializer):
+    distance_km: float
+
+
+def render_json(content) -> bytes:
+    # Same encoding as FastAPI's JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+# Key order of the nested objects in documents, the merge writes them this way but JSONB hands keys back shortest first
+DOCUMENT_OBJECTS = {
+    'location': ['lat', 'lng', 'address', 'city', 'country', 'postal_code'],
+    'amenities': ['general', 'room'],
+    'images': ['rooms', 'site', 'amenities'],
+}
+
+
+def document_order(content: dict) -> dict:
+    """Put the keys of the nested objects in DOCUMENT_OBJECTS order, any other key follows in its own order"""
+    ordered = dict(content)
+    for name, keys in DOCUMENT_OBJECTS.items():
+        value = ordered.get(name)
+        if isinstance(value, dict):
+            ordered[name] = {**{key: value[key] for key in keys if key in value}, **value}
+    return ordered
+
+
+def render_hotel(hotel) -> Optional[bytes]:
+    """Serialize a Hotel (or a dict of its columns) exactly like GET /hotels does"""
+    try:
+        if isinstance(hotel, dict):
+            serializer = HotelSerializer(**hotel)
+        else:
+            serializer = HotelSerializer.model_validate(hotel)
+    except ValidationError:
+        return None
+    return render_json(document_order(serializer.model_dump()))
@@ -0,0 +1,56 @@
+import html
+import re
+import sys
+from functools import lru_cache
+
+from config import *
+
+SCRIPT_TAGS = re.compile(r'<script\b[^>]*>.*?</script>', re.IGNORECASE | re.DOTALL)
+HTML_TAGS = re.compile(r'<[^>]+>')
+
+
+def clean_string(s: str) -> str:
+    s = s.strip()
+    # Without "<" or "&" there is nothing to unescape or strip, which is most strings
+    if '<' not in s and '&' not in s:
+        return s
+    s = html.unescape(s)  # First unescape any HTML entities
+    s = SCRIPT_TAGS.sub('', s)  # Remove script tags and their content
+    return HTML_TAGS.sub('', s)  # Remove other HTML tags
+
+
+@lru_cache(maxsize=SANITIZE_CACHE_SIZE)
+def cached_clean_string(s: str) -> str:
+    # Short values (amenities, cities, countries) repeat a lot, clean them once and share one copy
+    return sys.intern(clean_string(s))
+
+
+def sanitize_string(s: str) -> str:
+    if len(s) <= SANITIZE_CACHE_MAX_LENGTH:
+        return cached_clean_string(s)
+    return clean_string(s)
+
+
+def sanitize_data(data):
+    """Sanitize every string of a record, containers are only copied when something changed"""
+    if isinstance(data, str):
+        return sanitize_string(data)
+    if isinstance(data, dict):
+        cleaned = None
+        for key, value in data.items():
+            new_value = sanitize_data(value)
+            if new_value is not value and new_value != value:
+                if cleaned is None:
+                    cleaned = dict(data)
+                cleaned[key] = new_value
+        return data if cleaned is None else cleaned
+    if isinstance(data, list):
+        cleaned = None
+        for i, value in enumerate(data):
+            new_value = sanitize_data(value)
+            if new_value is not value and new_value != value:
+                if cleaned is None:
+                    cleaned = list(data)
+                cleaned[i] = new_value
+        return data if cleaned is None else cleaned
+    return data  # leave numbers, bools, None, etc. unchanged
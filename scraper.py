@@ -1,15 +1,73 @@
 import httpx
 import asyncio
-import html
 import json
-import re
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import logging
+import multiprocessing
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from datetime import datetime, timezone
+from itertools import chain
+from typing import Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select
+from sqlalchemy import column, delete, select, table as sql_table, text
+from sqlalchemy.dialects import postgresql, sqlite
 
 from config import *
 from models import *
-from api import engine, AsyncSessionLocal
+from database import create_engine_for
+from mappings import load_suppliers, map_records
+from sanitize import sanitize_data, sanitize_string
+from http_client import SupplierClient, iter_json_array
+from geo import geocell, valid_coordinates
+from search import refresh_search_vectors
+from amenities import index_amenities
+from sql_merge import merge_in_database
+from merge_queue import drain, enqueue
+from history import archive_attributes, compact_history
+from metrics import FETCHED_BYTES, REGISTRY, STAGE_RECORDS, timed
+
+logger = logging.getLogger(__name__)
+
+# Write engine, separate from the API's read engine
+engine = create_engine_for('scraper')
+AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+# Columns written per scraped record, the staging table of the COPY path mirrors them
+STAGED_COLUMNS = ('hotel_id', 'source', 'attributes', 'content_hash', 'updated_at')
+
+
+def upsert(dialect_name: str, table):
+    """Build an INSERT that supports ON CONFLICT for the given dialect"""
+    if dialect_name == 'postgresql':
+        return postgresql.insert(table)
+    if dialect_name == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError(f"Upsert is not supported on {dialect_name}")
+
+
+async def bump_merge_generation(session: AsyncSession):
+    """Tell the API that merged hotels changed"""
+    table = MergeGeneration.__table__
+    stmt = upsert(session.bind.dialect.name, table).values(id=1, generation=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={'generation': table.c.generation + 1}
+    )
+    await session.execute(stmt)
+
+
+async def iterate(data):
+    """Iterate over plain lists and streamed feeds alike"""
+    if hasattr(data, '__aiter__'):
+        async for item in data:
+            yield item
+    else:
+        for item in data:
+            yield item
 
 
 class Scraper:
@@ -20,301 +78,392 @@ class Scraper:
             class_=AsyncSession,
             expire_on_commit=False
         )
-        self.sources = {
-            'acme': 'https://5f2be0b4ffc88500167b85a0.mockapi.io/suppliers/acme',
-            'patagonia': 'https://5f2be0b4ffc88500167b85a0.mockapi.io/suppliers/patagonia',
-            'paperflies': 'https://5f2be0b4ffc88500167b85a0.mockapi.io/suppliers/paperflies'
-        }
-        self.scrapers = {
-            'acme': self.acme_scraper,
-            'patagonia': self.patagonia_scraper,
-            'paperflies': self.paperflies_scraper
-        }
-        self.source_priority = {
-            'acme': 0,
-            'patagonia': 4,
-            'paperflies': 6
-        }
+        self.suppliers = load_suppliers()
+        self.sources = {name: spec.url for name, spec in self.suppliers.items()}
+        self.source_priority = {name: spec.priority for name, spec in self.suppliers.items()}
+        self.scrapers = {name: partial(self.scrape, name) for name in self.suppliers}
+        self.merge_chunk_size = MERGE_CHUNK_SIZE
+        self.merge_backend = MERGE_BACKEND  # 'python' or 'sql'
+        self.merge_queue = MERGE_QUEUE  # hand changed hotels to merge workers instead of merging them here
+        self.merge_retry_delay = MERGE_QUEUE_RETRY_DELAY
+        self.merge_lock = asyncio.Lock()
+        self.conditional_gets = CONDITIONAL_GETS
+        self.http = SupplierClient()
+        self.streaming = STREAM_FEEDS
+        self.ingest_chunk_size = INGEST_CHUNK_SIZE
+        self.mapping_workers = MAPPING_WORKERS  # 0 cleans and maps records on the event loop
+        self.executor: Optional[ProcessPoolExecutor] = None
 
-    async def acme_scraper(self):
-        data = await self.async_request('GET', self.sources['acme'])
-        mapped_attributes = []
-        hotel_ids = []
-        for record in data:
-            # Simple data cleaning
-            record = self.sanitize_data(record) 
-
-            # Data attribute mapping
-            id = record['Id']
-            hotel_ids.append(id)
-            destination_id = record['DestinationId']
-            name = record['Name']
-            description = record['Description']
-            location = LocationSerializer(
-                lat=record.get('Latitude'),
-                lng=record.get('Longitude'),
-                address=record.get('Address'),
-                city=record.get('City'),
-                country=record.get('Country'),
-                postal_code=record.get('PostalCode')
-            )
-            amenities = AmenitiesSerializer(
-                general=record['Facilities'] if record.get('Facilities') else []
-            )
-            images = ImageSerializer()
-            booking_conditions = []
-
-            hotel_attributes = HotelAttribute(
-                hotel_id=id,
-                source='acme',
-                attributes=json.dumps({
-                    "id": id,
-                    "destination_id": destination_id,
-                    "name": name,
-                    "description": description,
-                    "location": location.model_dump(),
-                    "amenities": amenities.model_dump(),
-                    "images": images.model_dump(),
-                    "booking_conditions": booking_conditions
-                })
-            )
-            mapped_attributes.append(hotel_attributes)
-        async with AsyncSessionLocal() as session:
-            session.add_all(mapped_attributes)
-            await session.commit()
-        return hotel_ids
-
-    async def patagonia_scraper(self):
-        data = await self.async_request('GET', self.sources['patagonia'])
-        mapped_attributes = []
-        hotel_ids = []
-        for record in data:
-            record = self.sanitize_data(record) # Simple data cleaning
-            # Data attribute mapping
-            id = record['id']
-            hotel_ids.append(id)
-            destination_id = record['destination']
-            name = record['name']
-            description = record['info']
-            location = LocationSerializer(
-                lat=record.get('lat'),
-                lng=record.get('lng'),
-                address=record.get('address')
-            )
-            amenities = AmenitiesSerializer(
-                general=record['amenities'] if record.get('amenities') else []
-            )
-            images = ImageSerializer(
-                rooms=[
-                    ImageNestedSerializer(
-                        link=image.get('url'),
-                        description=image.get('description')
-                    ) for image in record.get('images', {}).get('rooms', [])
-                ],
-                site=[
-                    ImageNestedSerializer(
-                        link=image.get('url'),
-                        description=image.get('description')
-                    ) for image in record.get('images', {}).get('site', [])
-                ],
-                amenities=[
-                    ImageNestedSerializer(
-                        link=image.get('url'),
-                        description=image.get('description')
-                    ) for image in record.get('images', {}).get('amenities', [])
-                ]
-            )
-            
-            booking_conditions = []
-
-            hotel_attributes = HotelAttribute(
-                hotel_id=id,
-                source='patagonia',
-                attributes=json.dumps({
-                    "id": id,
-                    "destination_id": destination_id,
-                    "name": name,
-                    "description": description,
-                    "location": location.model_dump(),
-                    "amenities": amenities.model_dump(),
-                    "images": images.model_dump(),
-                    "booking_conditions": booking_conditions
-                })
-            )
-            mapped_attributes.append(hotel_attributes)
-        async with AsyncSessionLocal() as session:
-            session.add_all(mapped_attributes)
-            await session.commit()
-        return hotel_ids
-
-    async def paperflies_scraper(self):
-        data = await self.async_request('GET', self.sources['paperflies'])
-        mapped_attributes = []
-        hotel_ids = []
-        for record in data:
-            record = self.sanitize_data(record) # Simple data cleaning
-            # Data attribute mapping
-            id = record['hotel_id']
-            hotel_ids.append(id)
-            destination_id = record['destination_id']
-            name = record['hotel_name']
-            description = record['details']
-            location = LocationSerializer(
-                lat=record.get('location', {}).get('lat'),
-                lng=record.get('location', {}).get('lng'),
-                address=record.get('location', {}).get('address'),
-                country=record.get('location', {}).get('country')
+    @timed('scrape')
+    async def scrape(self, source: str, data=None) -> int:
+        if data is None:
+            data = await self.async_request('GET', self.sources[source])
+        return await self.ingest(source, data)
+
+    async def acme_scraper(self, data=None):
+        return await self.scrape('acme', data)
+
+    async def patagonia_scraper(self, data=None):
+        return await self.scrape('patagonia', data)
+
+    async def paperflies_scraper(self, data=None):
+        return await self.scrape('paperflies', data)
+
+    async def ingest(self, source: str, data) -> int:
+        """Store the records of a feed chunk by chunk, return how many were new or changed"""
+        # Records are cleaned, mapped and flushed in fixed-size chunks to bound memory. Changed ids are
+        # queued for merging with each chunk, only their count is kept for the whole feed
+        chunk_size = self.ingest_chunk_size * max(self.mapping_workers, 1)
+        changed = 0
+        records = []
+        async for record in iterate(data):
+            records.append(record)
+            if len(records) >= chunk_size:
+                changed += len(await self.save_attributes(source, await self.map_chunk(source, records)))
+                records = []
+        if records:
+            changed += len(await self.save_attributes(source, await self.map_chunk(source, records)))
+        return changed
+
+    @timed('map')
+    async def map_chunk(self, source: str, records: List[dict]) -> List[Tuple[str, str, str]]:
+        spec = self.suppliers[source]
+        STAGE_RECORDS.inc(len(records), stage='map', source=source)
+        if not self.mapping_workers:
+            return map_records(spec, records)
+        # CPU bound cleaning and mapping is spread over worker processes, off the event loop
+        loop = asyncio.get_running_loop()
+        batch_size = -(-len(records) // self.mapping_workers)
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self.get_executor(), map_records, spec, records[start:start + batch_size])
+            for start in range(0, len(records), batch_size)
+        ])
+        return list(chain.from_iterable(results))
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.mapping_workers,
+                mp_context=multiprocessing.get_context('spawn')  # never fork the running event loop
             )
-            source_amenities = record.get('amenities')
-            general_amenities = source_amenities['general'] if source_amenities.get('general') else []
-            general_amenities = [amenity.title() for amenity in general_amenities]
-
-            room_amenities = source_amenities['room'] if source_amenities.get('room') else []
-            amenities = AmenitiesSerializer(
-                general=general_amenities,
-                room=room_amenities
-            ) if source_amenities else None
-            images = ImageSerializer(
-                rooms=[
-                    ImageNestedSerializer(
-                        link=image.get('link'),
-                        description=image.get('caption')
-                    ) for image in record.get('images', {}).get('rooms', [])
-                ],
-                site=[
-                    ImageNestedSerializer(
-                        link=image.get('link'),
-                        description=image.get('caption')
-                    ) for image in record.get('images', {}).get('site', [])
-                ],
-                amenities=[
-                    ImageNestedSerializer(
-                        link=image.get('link'),
-                        description=image.get('caption')
-                    ) for image in record.get('images', {}).get('amenities', [])
+        return self.executor
+
+    @timed('write')
+    async def save_attributes(self, source: str, rows: List[Tuple[str, str, str]]) -> List[str]:
+        # The last row wins when a feed repeats an id
+        records = {id: (attributes, content_hash) for id, attributes, content_hash in rows}
+
+        async with self.session_factory() as session:
+            known_hashes = await self.load_content_hashes(session, source, list(records))
+            # Unchanged records are skipped so they are neither re-inserted nor re-merged
+            changed_ids = [
+                id for id, (_, content_hash) in records.items()
+                if known_hashes.get(id) != content_hash
+            ]
+            scraped_at = datetime.now(timezone.utc)
+            for start in range(0, len(changed_ids), self.ingest_chunk_size):
+                batch = changed_ids[start:start + self.ingest_chunk_size]
+                # Versions about to be replaced move to the history table first
+                await archive_attributes(session, source, batch, scraped_at)
+                await self.write_attributes(session, [
+                    {
+                        'hotel_id': id,
+                        'source': source,
+                        'attributes': records[id][0],
+                        'content_hash': records[id][1],
+                        'updated_at': scraped_at
+                    } for id in batch
+                ])
+                # Queued in the same transaction, the new hash is never stored without its pending merge
+                await enqueue(session, batch)
+                await session.commit()
+        STAGE_RECORDS.inc(len(changed_ids), stage='write', source=source)
+        return changed_ids
+
+    async def write_attributes(self, session: AsyncSession, rows: List[dict]):
+        # Bulk writes skip the ORM unit of work, one COPY or executemany per batch.
+        # Each (hotel_id, source) keeps a single current row, updated in place.
+        table = HotelAttribute.__table__
+        dialect = session.bind.dialect
+        if dialect.name == 'postgresql' and dialect.driver == 'asyncpg':
+            # COPY cannot upsert, rows are staged in a temporary table and upserted from there
+            await session.execute(text(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS hotel_attributes_staging "
+                "(LIKE hotel_attributes INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            ))
+            connection = await session.connection()
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                'hotel_attributes_staging',
+                columns=list(STAGED_COLUMNS),
+                records=[
+                    # Mapped attributes are already JSON text, COPY parses it into the jsonb column
+                    (row['hotel_id'], row['source'], row['attributes'], row['content_hash'], row['updated_at'])
+                    for row in rows
                 ]
             )
-            
-            booking_conditions = record.get('booking_conditions')
-
-            hotel_attributes = HotelAttribute(
-                hotel_id=id,
-                source='paperflies',
-                attributes=json.dumps({
-                    "id": id,
-                    "destination_id": destination_id,
-                    "name": name,
-                    "description": description,
-                    "location": location.model_dump(),
-                    "amenities": amenities.model_dump(),
-                    "images": images.model_dump(),
-                    "booking_conditions": booking_conditions
-                })
+            staging = sql_table('hotel_attributes_staging', *[column(name) for name in STAGED_COLUMNS])
+            stmt = postgresql.insert(table).from_select(list(STAGED_COLUMNS), select(staging))
+            params = None
+        else:
+            stmt = upsert(dialect.name, table)
+            # Decoded so the JSON column stores an object, not the JSON text as a string
+            params = [dict(row, attributes=json.loads(row['attributes'])) for row in rows]
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.hotel_id, table.c.source],
+            set_={name: stmt.excluded[name] for name in STAGED_COLUMNS if name not in ('hotel_id', 'source')}
+        )
+        await session.execute(stmt, params)
+
+    async def load_content_hashes(self, session: AsyncSession, source: str, hotel_ids: List[str]) -> Dict[str, str]:
+        hashes = {}
+        for start in range(0, len(hotel_ids), self.merge_chunk_size):
+            query = (
+                select(HotelAttribute.hotel_id, HotelAttribute.content_hash)
+                .where(HotelAttribute.source == source)
+                .where(HotelAttribute.hotel_id.in_(hotel_ids[start:start + self.merge_chunk_size]))
             )
-            mapped_attributes.append(hotel_attributes)
-        async with AsyncSessionLocal() as session:
-            session.add_all(mapped_attributes)
-            await session.commit()
-        return hotel_ids
-
-    async def data_merging(self, hotel_ids):
-        async with AsyncSessionLocal() as session:
-            hotels = []
-            for id in hotel_ids:
-                query = select(HotelAttribute).where(HotelAttribute.hotel_id == id)
-                result = await session.execute(query)
-                attributes = result.scalars().all()
-                sorted_attributes = sorted(
-                    attributes,
-                    key=lambda x: self.source_priority.get(x.source, 0),
-                    reverse=True
-                )
-                sorted_attributes = [json.loads(attributes.attributes) for attributes in sorted_attributes]
-
-                id = id
-                destination_id = self.get_attribute_value(sorted_attributes, 'destination_id')
-                name = self.get_attribute_value(sorted_attributes, 'name')
-                description = self.get_attribute_value(sorted_attributes, 'description')
-                booking_conditions = self.get_attribute_value(sorted_attributes, 'booking_conditions')
-
-                sorted_locations = [attributes.get('location') for attributes in sorted_attributes]
-                location = {
-                    'lat': self.get_attribute_value(sorted_locations, 'lat'),
-                    'lng': self.get_attribute_value(sorted_locations, 'lng'),
-                    'address': self.get_attribute_value(sorted_locations, 'address'),
-                    'country': self.get_attribute_value(sorted_locations, 'country')
-                }
-
-                sorted_amenities = [attributes.get('amenities') for attributes in sorted_attributes]
-                amenities = {
-                    'general': self.get_attribute_value(sorted_amenities, 'general', []),
-                    'room': self.get_attribute_value(sorted_amenities, 'room', [])
-                }
-
-                sorted_images = [attributes.get('images') for attributes in sorted_attributes]
-                images = {
-                    'rooms': self.get_attribute_value(sorted_images, 'rooms', []),
-                    'site': self.get_attribute_value(sorted_images, 'site', []),
-                    'amenities': self.get_attribute_value(sorted_images, 'amenities', [])
-                }
-
-                hotels.append(Hotel(
-                    id=id,
-                    destination_id=destination_id,
-                    name=name,
-                    description=description,
-                    booking_conditions=booking_conditions,
-                    location=location,
-                    amenities=amenities,
-                    images=images,
-                ))
+            result = await session.execute(query)
+            hashes.update(result.all())
+        return hashes
+
+    @timed('merge')
+    async def data_merging(self, hotel_ids, chunk_size: Optional[int] = None):
+        chunk_size = chunk_size or self.merge_chunk_size
+        hotel_ids = list(dict.fromkeys(hotel_ids))  # drop duplicates, keep order
+        for start in range(0, len(hotel_ids), chunk_size):
+            chunk = hotel_ids[start:start + chunk_size]
+            async with self.session_factory() as session, self.locked_hotels(session, chunk):
+                if self.merge_backend == 'sql':
+                    # Attributes never leave the database, only the merged rows are read back for their documents
+                    merged = await merge_in_database(session, chunk, self.source_priority)
+                else:
+                    merged = await self.merge_chunk(session, chunk)
+                STAGE_RECORDS.inc(merged, stage='merge')
+                if merged:
+                    await refresh_search_vectors(session, chunk)
+                    await index_amenities(session, chunk)
+                    await session.commit()
+        if hotel_ids:
             async with self.session_factory() as session:
-                session.add_all(hotels)
+                await bump_merge_generation(session)
                 await session.commit()
 
+    @asynccontextmanager
+    async def locked_hotels(self, session: AsyncSession, hotel_ids: List[str]):
+        """Hold hotel_ids until the merge transaction ends, a concurrent merge of the same hotels reads after it"""
+        if session.bind.dialect.name == 'postgresql':
+            # One lock per hash bucket keeps a chunk under max_locks_per_transaction whatever its size.
+            # Released by the commit or rollback, taken in bucket order so overlapping chunks cannot deadlock
+            await session.execute(
+                text(
+                    "SELECT pg_advisory_xact_lock(:namespace, bucket) FROM ("
+                    "SELECT DISTINCT (hashtext(id) & 2147483647) % :buckets AS bucket "
+                    "FROM unnest(CAST(:hotel_ids AS text[])) AS id ORDER BY bucket) buckets"
+                ),
+                {'namespace': MERGE_LOCK_NAMESPACE, 'buckets': MERGE_LOCK_BUCKETS, 'hotel_ids': hotel_ids}
+            )
+            yield
+        else:
+            # No row locks to share between processes here, merges of this process run one at a time
+            async with self.merge_lock:
+                yield
+
+    async def merge_chunk(self, session: AsyncSession, hotel_ids: List[str]) -> int:
+        # One round trip to load every source record of the chunk
+        query = (
+            select(HotelAttribute.hotel_id, HotelAttribute.source, HotelAttribute.attributes)
+            .where(HotelAttribute.hotel_id.in_(hotel_ids))
+            .order_by(HotelAttribute.id)
+        )
+        result = await session.execute(query)
+        grouped = {}
+        for hotel_id, source, attributes in result:
+            # One current row per source, ordered by first insertion for equal priorities
+            grouped.setdefault(hotel_id, {})[source] = attributes
+
+        hotels = [
+            self.merge_hotel(id, grouped[id])
+            for id in hotel_ids if id in grouped
+        ]
+        if hotels:
+            await self.upsert_hotels(session, hotels)
+        return len(hotels)
+
+    def merge_hotel(self, id: str, source_attributes: Dict[str, dict]) -> dict:
+        sorted_sources = sorted(
+            source_attributes,
+            key=lambda source: self.source_priority.get(source, 0),
+            reverse=True
+        )
+        sorted_attributes = [source_attributes[source] for source in sorted_sources]
+
+        destination_id = self.get_attribute_value(sorted_attributes, 'destination_id')
+        name = self.get_attribute_value(sorted_attributes, 'name')
+        description = self.get_attribute_value(sorted_attributes, 'description')
+        booking_conditions = self.get_attribute_value(sorted_attributes, 'booking_conditions')
+
+        sorted_locations = [attributes.get('location') for attributes in sorted_attributes]
+        location = {
+            'lat': self.get_attribute_value(sorted_locations, 'lat'),
+            'lng': self.get_attribute_value(sorted_locations, 'lng'),
+            'address': self.get_attribute_value(sorted_locations, 'address'),
+            'country': self.get_attribute_value(sorted_locations, 'country')
+        }
+
+        sorted_amenities = [attributes.get('amenities') for attributes in sorted_attributes]
+        amenities = {
+            'general': self.get_attribute_value(sorted_amenities, 'general', []),
+            'room': self.get_attribute_value(sorted_amenities, 'room', [])
+        }
+
+        sorted_images = [attributes.get('images') for attributes in sorted_attributes]
+        images = {
+            'rooms': self.get_attribute_value(sorted_images, 'rooms', []),
+            'site': self.get_attribute_value(sorted_images, 'site', []),
+            'amenities': self.get_attribute_value(sorted_images, 'amenities', [])
+        }
+
+        hotel = dict(
+            id=id,
+            destination_id=destination_id,
+            name=name,
+            description=description,
+            booking_conditions=booking_conditions,
+            location=location,
+            amenities=amenities,
+            images=images,
+        )
+        # Serialized once here so the API can send it without re-validating
+        hotel['document'] = render_hotel(hotel)
+        if valid_coordinates(location['lat'], location['lng']):
+            hotel.update(lat=location['lat'], lng=location['lng'], geocell=geocell(location['lat'], location['lng']))
+        else:
+            hotel.update(lat=None, lng=None, geocell=None)
+        return hotel
+
+    async def upsert_hotels(self, session: AsyncSession, hotels: List[dict]):
+        # Re-running the merge updates hotels in place instead of failing on hotels.id
+        stmt = upsert(session.bind.dialect.name, Hotel.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Hotel.id],
+            set_={column: stmt.excluded[column] for column in hotels[0] if column != 'id'}
+        )
+        await session.execute(stmt, hotels)
+
+    @timed('sensor')
     async def sensor(self):
-        sources = []
-        queries = []
-        scrapers = []
-        all_hotel_ids = set()
-        for source in self.sources:
-            sources.append(source)
-            queries.append(self.async_request('GET', self.sources[source]))
-        results = await asyncio.gather(*queries)
-        for i in range(len(sources)):
-            if len(results[i]):
-                scrapers.append(self.scrapers[sources[i]]())
-        scraper_results = await asyncio.gather(*scrapers)
-
-        # Collect all unique hotel IDs from scrapers
-        for hotel_ids in scraper_results:
-            all_hotel_ids.update(hotel_ids)
-
-        # Mapping all clustered data with collected IDs
-        await self.data_merging(list(all_hotel_ids))
-
-    async def async_request(self, method: str, url: str) -> httpx.Response:
-        async with httpx.AsyncClient() as client:
-             res = await client.request(method=method, url=url, timeout=300)
-             res.raise_for_status()
-             return res.json()
+        # Each source is fetched once, its payload goes straight to its scraper
+        await asyncio.gather(*[self.run_source(source) for source in self.sources])
+        await self.schedule_merge()
+
+    async def schedule_merge(self):
+        """Merge the queued hotels now, or leave them to the merge workers with MERGE_QUEUE"""
+        if self.merge_queue:
+            return
+        # Batches a failed merge handed back are retried here too, once their retry delay has passed
+        merged = await drain(self, f'{socket.gethostname()}-{os.getpid()}', retry_delay=self.merge_retry_delay)
+        if merged:
+            logger.info("%d queued batches merged", merged)
+
+    async def compact_history(self):
+        """Create the upcoming history partitions and drop the versions past HISTORY_RETENTION_DAYS"""
+        async with self.session_factory() as session:
+            await compact_history(session)
+            await session.commit()
+
+    async def conditional_headers(self, url: str) -> dict:
+        """If-None-Match/If-Modified-Since built from the validators stored for url"""
+        async with self.session_factory() as session:
+            validator = await session.get(FeedValidator, url)
+        headers = {}
+        if validator and validator.etag:
+            headers['If-None-Match'] = validator.etag
+        if validator and validator.last_modified:
+            headers['If-Modified-Since'] = validator.last_modified
+        return headers
+
+    async def store_validators(self, url: str, response: httpx.Response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        async with self.session_factory() as session:
+            if etag or last_modified:
+                stmt = upsert(session.bind.dialect.name, FeedValidator.__table__)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[FeedValidator.url],
+                    set_={column: stmt.excluded[column] for column in ('etag', 'last_modified', 'updated_at')}
+                )
+                await session.execute(stmt, [{
+                    'url': url, 'etag': etag, 'last_modified': last_modified, 'updated_at': datetime.now(timezone.utc)
+                }])
+            else:
+                # Validators of an older version must not answer for this one
+                await session.execute(delete(FeedValidator).where(FeedValidator.url == url))
+            await session.commit()
+
+    @timed('supplier')
+    async def run_source(self, source: str) -> int:
+        url = self.sources[source]
+        headers = await self.conditional_headers(url) if self.conditional_gets else {}
+        res = await self.async_send('GET', url, headers=headers, source=source, stream=self.streaming)
+        try:
+            if res.status_code == 304:
+                logger.info("%s: feed not modified", source)
+                return 0  # The feed has not changed since the last successful run
+            res.raise_for_status()
+            if self.streaming:
+                # Records are parsed as the body arrives instead of loading the whole array
+                data = iter_json_array(res.aiter_bytes())
+            else:
+                data = res.json()
+                if not len(data):
+                    return 0
+            changed = await self.scrapers[source](data)
+        finally:
+            await res.aclose()
+            FETCHED_BYTES.inc(res.num_bytes_downloaded, source=source)
+        logger.info("%s: %d new or changed records", source, changed)
+        # Committed after the records and their queued merges, a crash in between only fetches the feed again.
+        # Kept in the database, so a reset schema is never answered with 304
+        if self.conditional_gets:
+            await self.store_validators(url, res)
+        return changed
+
+    async def async_request(self, method: str, url: str):
+        res = await self.async_send(method, url)
+        res.raise_for_status()
+        return res.json()
+
+    @timed('fetch')
+    async def async_send(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[dict] = None,
+        source: Optional[str] = None,
+        stream: bool = False
+    ) -> httpx.Response:
+        return await self.http.request(method, url, key=source, headers=headers, stream=stream)
+
+    async def close(self):
+        await self.http.aclose()
+        if self.executor is not None:
+            # Joining the worker processes blocks, keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+            self.executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
 
     def sanitize_string(self, s: str) -> str:
-        s = html.unescape(s.strip())  # First unescape any HTML entities
-        s = re.sub(r'<script\b[^>]*>.*?</script>', '', s, flags=re.IGNORECASE | re.DOTALL)  # Remove script tags and their content
-        s = re.sub(r'<[^>]+>', '', s)  # Remove other HTML tags
-        return s
+        return sanitize_string(s)
 
     def sanitize_data(self, data):
-        if isinstance(data, dict):
-            return {k: self.sanitize_data(v) for k, v in data.items()}
-        elif isinstance(data, list):
-            return [self.sanitize_data(item) for item in data]
-        elif isinstance(data, str):
-            return self.sanitize_string(data)
-        else:
-            return data  # leave numbers, bools, None, etc. unchanged
-        
+        return sanitize_data(data)
+
     def get_attribute_value(self, sorted_attributes: List[dict], attribute_name: str, default_data = None):
         for attributes in sorted_attributes:
             if attributes.get(attribute_name) not in [None, "", []]:
@@ -322,6 +471,16 @@ class Scraper:
         return default_data
 
 
+async def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    try:
+        async with Scraper() as scraper:
+            await scraper.sensor()
+    finally:
+        await engine.dispose()
+        # Per-stage durations, record counts, bytes and errors of this run
+        print(json.dumps(REGISTRY.summary(), indent=2))
+
+
 if __name__ == "__main__":
-    scraper = Scraper()
-    asyncio.run(scraper.sensor())
+    asyncio.run(main())
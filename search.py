@@ -0,0 +1,51 @@
+import re
+from typing import List
+
+from sqlalchemy import cast, column, func, literal_column, select, table, update
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import *
+from models import Hotel
+
+WORDS = re.compile(r'\w+')
+
+# FTS5 index of the hotels rows (see models.py), joined on the rowid of hotels
+hotels_fts = table('hotels_fts', column('rowid'))
+
+
+def search_vector():
+    """tsvector of a hotel, name matches rank above description matches"""
+    language = cast(SEARCH_LANGUAGE, REGCONFIG)
+    return func.setweight(func.to_tsvector(language, func.coalesce(Hotel.name, '')), literal_column("'A'")).op('||')(
+        func.setweight(func.to_tsvector(language, func.coalesce(Hotel.description, '')), literal_column("'B'"))
+    )
+
+
+async def refresh_search_vectors(session: AsyncSession, hotel_ids: List[str]):
+    """Recompute search_vector of merged hotels, SQLite triggers already keep hotels_fts in sync"""
+    if session.bind.dialect.name == 'postgresql':
+        await session.execute(
+            update(Hotel).where(Hotel.id.in_(hotel_ids)).values(search_vector=search_vector())
+        )
+
+
+def fts_query(q: str) -> str:
+    # Every word quoted so user input cannot be parsed as FTS5 syntax, words are ANDed
+    return ' '.join(f'"{word}"' for word in WORDS.findall(q))
+
+
+def search_query(dialect_name: str, q: str):
+    """Select (id, score) of hotels matching q, a lower score is a better match"""
+    if dialect_name == 'postgresql':
+        tsquery = func.websearch_to_tsquery(cast(SEARCH_LANGUAGE, REGCONFIG), q)
+        score = -func.ts_rank(Hotel.search_vector, tsquery)
+        return select(Hotel.id, score.label('score')).where(Hotel.search_vector.op('@@')(tsquery)), score
+    # bm25 is already lower-is-better, name weighted like the 'A' lexemes on Postgres
+    score = func.bm25(literal_column('hotels_fts'), 10.0, 1.0)
+    query = (
+        select(Hotel.id, score.label('score'))
+        .join(hotels_fts, hotels_fts.c.rowid == literal_column('hotels.rowid'))
+        .where(literal_column('hotels_fts').op('MATCH')(fts_query(q)))
+    )
+    return query, score
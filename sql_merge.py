@@ -0,0 +1,223 @@
+from typing import Dict, List
+
+from sqlalchemy import bindparam, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import *
+from models import Hotel, HotelSerializer, render_hotel
+
+# Merged layout of Scraper.merge_hotel: top level fields, then nested objects and their keys
+MERGED_FIELDS = ['destination_id', 'name', 'description', 'booking_conditions']
+MERGED_OBJECTS = {
+    'location': ['lat', 'lng', 'address', 'country'],
+    'amenities': ['general', 'room'],
+    'images': ['rooms', 'site', 'amenities'],
+}
+# Nested keys that fall back to an empty list instead of null when no source has a value
+LIST_OBJECTS = {'amenities', 'images'}
+
+COLUMNS = ['id', 'destination_id', 'name', 'description', 'booking_conditions',
+           'location', 'amenities', 'images', 'document', 'lat', 'lng', 'geocell']
+
+
+def merged_paths() -> List[List[str]]:
+    paths = [[field] for field in MERGED_FIELDS]
+    for name, keys in MERGED_OBJECTS.items():
+        paths += [[name, key] for key in keys]
+    return paths
+
+
+def alias(path: List[str]) -> str:
+    return '_'.join(path)
+
+
+def priorities_cte(source_priority: Dict[str, int]) -> str:
+    rows = ', '.join(
+        f'(CAST(:source_{position} AS TEXT), CAST(:priority_{position} AS INTEGER))'
+        for position in range(len(source_priority))
+    )
+    return f'priorities (source, priority) AS (VALUES {rows})'
+
+
+def priority_params(source_priority: Dict[str, int]) -> dict:
+    params = {}
+    for position, (source, priority) in enumerate(source_priority.items()):
+        params[f'source_{position}'] = source
+        params[f'priority_{position}'] = priority
+    return params
+
+
+def postgresql_statement(source_priority: Dict[str, int]) -> str:
+    def empty(value):
+        return f"({value} IS NULL OR {value} IN ('null', '\"\"', '[]'))"
+
+    def extract(path):
+        return f"a #> '{{{','.join(path)}}}'"
+
+    # First non-empty value by priority, ties keep the order in which sources were first stored
+    picks = ',\n        '.join(
+        f'(array_agg({extract(path)} ORDER BY priority DESC, first_id) '
+        f'FILTER (WHERE NOT {empty(extract(path))}))[1] AS {alias(path)}'
+        for path in merged_paths()
+    )
+
+    def build_object(name):
+        default = "'[]'::jsonb" if name in LIST_OBJECTS else 'NULL'
+        pairs = ', '.join(f"'{key}', coalesce({alias([name, key])}, {default})" for key in MERGED_OBJECTS[name])
+        return f'jsonb_build_object({pairs})'
+
+    updates = ', '.join(f'{column} = excluded.{column}' for column in COLUMNS if column != 'id')
+    return f"""
+WITH {priorities_cte(source_priority)},
+ranked AS (
+    SELECT ha.hotel_id,
+        ha.attributes AS a,
+        coalesce(p.priority, 0) AS priority,
+        ha.id AS first_id
+    FROM hotel_attributes ha
+    LEFT JOIN priorities p ON p.source = ha.source
+    WHERE ha.hotel_id IN :hotel_ids
+),
+merged AS (
+    SELECT hotel_id AS id,
+        {picks}
+    FROM ranked
+    GROUP BY hotel_id
+),
+coordinates AS (
+    SELECT merged.*,
+        CASE WHEN jsonb_typeof(location_lat) = 'number' THEN (location_lat #>> '{{}}')::float8 END AS lat_number,
+        CASE WHEN jsonb_typeof(location_lng) = 'number' THEN (location_lng #>> '{{}}')::float8 END AS lng_number
+    FROM merged
+),
+valid AS (
+    SELECT coordinates.*,
+        coalesce(lat_number BETWEEN -90 AND 90 AND lng_number BETWEEN -180 AND 180, false) AS has_coordinates
+    FROM coordinates
+)
+INSERT INTO hotels ({', '.join(COLUMNS)})
+SELECT id,
+    (destination_id #>> '{{}}')::integer,
+    name #>> '{{}}',
+    description #>> '{{}}',
+    coalesce(booking_conditions, 'null'::jsonb),
+    {build_object('location')},
+    {build_object('amenities')},
+    {build_object('images')},
+    NULL,
+    CASE WHEN has_coordinates THEN lat_number END,
+    CASE WHEN has_coordinates THEN lng_number END,
+    CASE WHEN has_coordinates THEN floor((lat_number + 90) / CAST(:geocell_size AS float8))::integer END
+FROM valid
+ON CONFLICT (id) DO UPDATE SET {updates}
+"""
+
+
+def sqlite_statement(source_priority: Dict[str, int]) -> str:
+    def empty(value):
+        return f"({value} IS NULL OR {value} IN ('null', '\"\"', '[]'))"
+
+    extracts = ',\n        '.join(f"a -> '$.{'.'.join(path)}' AS {alias(path)}" for path in merged_paths())
+    # No ordered aggregates on SQLite, each field takes the first row of its own window instead
+    picks = ',\n        '.join(
+        f'first_value({alias(path)}) OVER (PARTITION BY hotel_id ORDER BY {empty(alias(path))}, '
+        f'priority DESC, first_id) AS {alias(path)}'
+        for path in merged_paths()
+    )
+
+    def value(path, default='NULL'):
+        return f'CASE WHEN {empty(alias(path))} THEN {default} ELSE json({alias(path)}) END'
+
+    def build_object(name):
+        default = "'[]'" if name in LIST_OBJECTS else 'NULL'
+        pairs = ', '.join(f"'{key}', json({value([name, key], default)})" for key in MERGED_OBJECTS[name])
+        return f'json_object({pairs})'
+
+    updates = ', '.join(f'{column} = excluded.{column}' for column in COLUMNS if column != 'id')
+    return f"""
+WITH {priorities_cte(source_priority)},
+ranked AS (
+    SELECT ha.hotel_id,
+        ha.attributes AS a,
+        coalesce(p.priority, 0) AS priority,
+        ha.id AS first_id
+    FROM hotel_attributes ha
+    LEFT JOIN priorities p ON p.source = ha.source
+    WHERE ha.hotel_id IN :hotel_ids
+),
+records AS (
+    SELECT hotel_id, priority, first_id,
+        {extracts}
+    FROM ranked
+),
+picked AS (
+    SELECT hotel_id AS id,
+        {picks},
+        row_number() OVER (PARTITION BY hotel_id) AS position
+    FROM records
+),
+coordinates AS (
+    SELECT picked.*,
+        CASE WHEN json_type(location_lat) IN ('integer', 'real') THEN location_lat ->> '$' END AS lat_number,
+        CASE WHEN json_type(location_lng) IN ('integer', 'real') THEN location_lng ->> '$' END AS lng_number
+    FROM picked
+    WHERE position = 1
+),
+valid AS (
+    SELECT coordinates.*,
+        coalesce(lat_number BETWEEN -90 AND 90 AND lng_number BETWEEN -180 AND 180, 0) AS has_coordinates
+    FROM coordinates
+)
+INSERT INTO hotels ({', '.join(COLUMNS)})
+SELECT id,
+    {value(['destination_id'])} ->> '$',
+    {value(['name'])} ->> '$',
+    {value(['description'])} ->> '$',
+    {value(['booking_conditions'], "'null'")},
+    {build_object('location')},
+    {build_object('amenities')},
+    {build_object('images')},
+    NULL,
+    CASE WHEN has_coordinates THEN lat_number END,
+    CASE WHEN has_coordinates THEN lng_number END,
+    -- lat + 90 is never negative, so the integer cast is the floor
+    CASE WHEN has_coordinates THEN CAST((lat_number + 90) / CAST(:geocell_size AS REAL) AS INTEGER) END
+FROM valid
+WHERE true  -- required by SQLite before ON CONFLICT in an INSERT ... SELECT
+ON CONFLICT (id) DO UPDATE SET {updates}
+"""
+
+
+STATEMENTS = {'postgresql': postgresql_statement, 'sqlite': sqlite_statement}
+
+
+async def store_documents(session: AsyncSession, hotel_ids: List[str]):
+    """Serialize the merged hotels once, like merge_hotel does, so the API sends them as is"""
+    result = await session.execute(
+        select(*[getattr(Hotel, field) for field in HotelSerializer.model_fields]).where(Hotel.id.in_(hotel_ids))
+    )
+    documents = [{'hotel_id': row.id, 'document': render_hotel(dict(row._mapping))} for row in result]
+    if documents:
+        table = Hotel.__table__
+        await session.execute(
+            update(table).where(table.c.id == bindparam('hotel_id')).values(document=bindparam('document')),
+            documents
+        )
+
+
+async def merge_in_database(session: AsyncSession, hotel_ids: List[str], source_priority: Dict[str, int]) -> int:
+    """Merge the stored attributes of hotel_ids into hotels with one INSERT ... SELECT, return the merged count
+
+    Produces the same rows as Scraper.merge_hotel. Attributes stay in the database, only the
+    merged hotels are read back to store their serialized document.
+    """
+    dialect_name = session.bind.dialect.name
+    if dialect_name not in STATEMENTS:
+        raise NotImplementedError(f"SQL merge is not supported on {dialect_name}")
+    statement = text(STATEMENTS[dialect_name](source_priority)).bindparams(bindparam('hotel_ids', expanding=True))
+    result = await session.execute(
+        statement,
+        dict(priority_params(source_priority), hotel_ids=hotel_ids, geocell_size=GEOCELL_SIZE)
+    )
+    await store_documents(session, hotel_ids)
+    return result.rowcount
@@ -1,10 +1,11 @@
+import os
 import pytest
 import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from fastapi.testclient import TestClient
 
-from api import app, get_session
+from api import app, get_session, get_session_factory, hotels_cache, generation_tracker
 from models import Base
 from config import DATABASE_URL
 
@@ -39,16 +40,38 @@ async def test_session(test_engine):
         yield session
 
 @pytest.fixture
-def test_client(test_session):
+def test_client(test_engine, test_session):
     """Create a test client with the test database session."""
     async def override_get_session():
         yield test_session
 
+    async def override_get_session_factory():
+        return sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False)
+
     app.dependency_overrides[get_session] = override_get_session
+    app.dependency_overrides[get_session_factory] = override_get_session_factory
+    # Every test starts with an empty response cache
+    hotels_cache.clear()
+    generation_tracker.reset()
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
 
+@pytest.fixture
+async def postgres_engine():
+    """An engine on a fresh schema in the Postgres database of TEST_POSTGRES_URL, skipped without one"""
+    url = os.getenv("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+
 # Sample test data
 @pytest.fixture
 def sample_hotel_data():
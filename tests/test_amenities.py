@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import select
+from amenities import amenity_key, index_amenities, load_vocabulary
+from models import Amenity, Hotel
+
+
+def test_amenity_key():
+    """Test spelling variants of an amenity share one key"""
+    assert amenity_key("BusinessCenter") == amenity_key("business center") == amenity_key("business-center")
+    assert amenity_key("WiFi") == "wifi"
+
+
+@pytest.mark.asyncio
+async def test_index_amenities(test_session, sample_hotel_data):
+    """Test merged amenities are added to the vocabulary and set in amenity_mask"""
+    test_session.add_all([
+        Hotel(**dict(sample_hotel_data, id="h1", amenities={"general": ["wifi", "pool"], "room": ["tv"]})),
+        Hotel(**dict(sample_hotel_data, id="h2", amenities={"general": ["business center", "wifi"], "room": []})),
+        Hotel(**dict(sample_hotel_data, id="h3", amenities={"general": ["spa"], "room": []})),
+    ])
+    await test_session.commit()
+
+    await index_amenities(test_session, ["h1", "h2"])
+    await index_amenities(test_session, ["h1", "h2"])  # known amenities are not added again
+    await test_session.commit()
+
+    vocabulary = (await test_session.execute(select(Amenity.key, Amenity.id).order_by(Amenity.id))).all()
+    # The most listed amenity gets the first id
+    assert vocabulary == [("wifi", 1), ("businesscenter", 2), ("pool", 3), ("tv", 4)]
+
+    test_session.expire_all()
+    masks = dict((await test_session.execute(select(Hotel.id, Hotel.amenity_mask))).all())
+    assert masks == {"h1": 0b1101, "h2": 0b0011, "h3": 0}
+
+    assert await load_vocabulary(test_session, ["BusinessCenter", "WiFi", "sauna"]) == {
+        "businesscenter": (2, "business center"), "wifi": (1, "wifi")
+    }
@@ -1,6 +1,18 @@
+import json
 import pytest
 from fastapi import status
-from models import Hotel
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from models import Hotel, HotelSerializer, render_hotel
+from api import generation_tracker, hotels_cache
+import api as api_module
+from cache import TTLCache
+from config import API_POOL_SIZE, MERGE_GENERATION_POLL_INTERVAL
+from scraper import bump_merge_generation
+from metrics import REJECTED_DOCUMENTS
+from geo import geocell
+from amenities import index_amenities
+from sqlalchemy import update
 
 @pytest.mark.asyncio
 async def test_get_hotels_empty(test_client):
@@ -99,4 +111,314 @@ async def test_get_hotels_invalid_params(test_client):
     # Test with non-existent hotel IDs
     response = test_client.get("/hotels?hotels=non_existent_1,non_existent_2")
     assert response.status_code == status.HTTP_200_OK
-    assert response.json() == [] 
\ No newline at end of file
+    assert response.json() == [] 
+
+
+@pytest.mark.asyncio
+async def test_get_hotels_keyset_pagination(test_client, test_session, sample_hotel_data, monkeypatch):
+    """Test pages follow the next cursor until the last page"""
+    for i in range(5):
+        test_session.add(Hotel(**dict(sample_hotel_data, id=f"hotel_{i}")))
+    await test_session.commit()
+
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        url = "/hotels?limit=2" + (f"&cursor={cursor}" if cursor else "")
+        response = test_client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        seen += [h["id"] for h in response.json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert pages == 3
+    assert seen == [f"hotel_{i}" for i in range(5)]
+
+    # Page size is capped server side and bad cursors are rejected
+    monkeypatch.setattr(api_module, "HOTELS_MAX_PAGE_SIZE", 3)
+    response = test_client.get("/hotels?limit=100000")
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()) == 3
+    assert response.headers["X-Next-Cursor"]
+    assert test_client.get("/hotels?limit=0").status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert test_client.get("/hotels?cursor=%%%").status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_get_hotels_pages_across_rejected_rows(test_client, test_session, sample_hotel_data):
+    """Test a row HotelSerializer rejects is left out without ending the pages early"""
+    REJECTED_DOCUMENTS.values.clear()
+    for id in ["h1", "h2", "h3", "h4"]:
+        test_session.add(Hotel(**dict(sample_hotel_data, id=id, description=None if id == "h2" else "Valid")))
+    await test_session.commit()
+
+    first = test_client.get("/hotels?limit=2")
+    assert [hotel["id"] for hotel in first.json()] == ["h1"]
+    second = test_client.get(f"/hotels?limit=2&cursor={first.headers['X-Next-Cursor']}")
+    assert [hotel["id"] for hotel in second.json()] == ["h3", "h4"]
+    assert "X-Next-Cursor" not in second.headers
+    assert REJECTED_DOCUMENTS.get() == 1
+
+
+@pytest.mark.asyncio
+async def test_get_hotels_cache_invalidated_by_merge_generation(test_client, test_session, sample_hotel_data):
+    """Test repeated queries are served from cache until a merge bumps the generation"""
+    generation_tracker.interval = 0
+    try:
+        test_session.add(Hotel(**sample_hotel_data))
+        await test_session.commit()
+
+        first = test_client.get("/hotels?hotels=test_hotel_1&destination=1")
+        assert first.headers["X-Cache"] == "MISS"
+        # The same query with a different parameter spelling hits the cache
+        second = test_client.get("/hotels?destination=1&hotels=test_hotel_1,test_hotel_1")
+        assert second.headers["X-Cache"] == "HIT"
+        assert second.content == first.content
+
+        hotel = await test_session.get(Hotel, "test_hotel_1")
+        hotel.name = "Renamed Hotel"
+        await bump_merge_generation(test_session)
+        await test_session.commit()
+
+        third = test_client.get("/hotels?hotels=test_hotel_1&destination=1")
+        assert third.headers["X-Cache"] == "MISS"
+        assert third.json()[0]["name"] == "Renamed Hotel"
+
+        stats = test_client.get("/cache/stats").json()
+        assert stats["hits"] >= 1
+        assert stats["generation"] == 1
+    finally:
+        generation_tracker.interval = MERGE_GENERATION_POLL_INTERVAL
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    """Test the cache is bounded and entries expire"""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    expired = TTLCache(maxsize=2, ttl=-1)
+    expired.set("a", 1)
+    assert expired.get("a") is None
+    assert expired.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_get_hotels_serves_stored_documents(test_client, test_session, sample_hotel_data):
+    """Test stored documents are sent as is and match the response_model encoding byte for byte"""
+    expected = JSONResponse(jsonable_encoder([HotelSerializer(**sample_hotel_data)])).body
+
+    test_session.add(Hotel(**sample_hotel_data, document=render_hotel(sample_hotel_data)))
+    await test_session.commit()
+    assert test_client.get("/hotels").content == expected
+
+    # Hotels written without a document are serialized on the fly
+    hotel = await test_session.get(Hotel, "test_hotel_1")
+    hotel.document = None
+    await test_session.commit()
+    hotels_cache.clear()
+    assert test_client.get("/hotels").content == expected
+
+    # A stored document is trusted as is, proving the row columns are not re-serialized
+    hotel.document = b'{"id":"test_hotel_1","stored":true}'
+    await test_session.commit()
+    hotels_cache.clear()
+    assert test_client.get("/hotels").json() == [{"id": "test_hotel_1", "stored": True}]
+
+
+@pytest.mark.asyncio
+async def test_get_hotels_sparse_fieldsets(test_client, test_session, sample_hotel_data):
+    """Test fields= trims the response and rejects unknown fields"""
+    test_session.add(Hotel(**sample_hotel_data))
+    await test_session.commit()
+
+    response = test_client.get("/hotels?fields=name,location")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{
+        "id": sample_hotel_data["id"],
+        "name": sample_hotel_data["name"],
+        "location": sample_hotel_data["location"]
+    }]
+
+    response = test_client.get("/hotels?fields=id&fields=destination_id")
+    assert response.json() == [{"id": sample_hotel_data["id"], "destination_id": 1}]
+
+    response = test_client.get("/hotels?fields=name,secret")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+async def test_export_hotels_ndjson(test_client, test_session, sample_hotel_data):
+    """Test the export streams one JSON document per line, optionally gzipped"""
+    REJECTED_DOCUMENTS.values.clear()
+    test_session.add(Hotel(**sample_hotel_data, document=render_hotel(sample_hotel_data)))
+    test_session.add(Hotel(**dict(sample_hotel_data, id="test_hotel_2", destination_id=2)))
+    test_session.add(Hotel(**dict(sample_hotel_data, id="test_hotel_3", description=None)))
+    await test_session.commit()
+
+    response = test_client.get("/hotels/export")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [hotel["id"] for hotel in lines] == ["test_hotel_1", "test_hotel_2"]
+    assert lines[1]["destination_id"] == 2
+    # Left out like on GET /hotels, and counted the same way
+    assert REJECTED_DOCUMENTS.get() == 1
+
+    response = test_client.get("/hotels/export?destination=2&gzip=true")
+    assert response.headers["content-encoding"] == "gzip"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [hotel["id"] for hotel in lines] == ["test_hotel_2"]
+
+
+@pytest.mark.asyncio
+async def test_get_hotels_by_amenity(test_client, test_session, sample_hotel_data):
+    """Test amenity= keeps hotels listing every requested amenity in any group"""
+    test_session.add(Hotel(**sample_hotel_data))  # general: wifi, parking / room: tv, safe
+    test_session.add(Hotel(**dict(
+        sample_hotel_data, id="test_hotel_2", amenities={"general": ["pool"], "room": ["wifi"]}
+    )))
+    await test_session.commit()
+    # Merges index the amenities they see, names outside the vocabulary match no hotel
+    await index_amenities(test_session, ["test_hotel_1", "test_hotel_2"])
+    await test_session.commit()
+
+    def ids(url):
+        return [hotel["id"] for hotel in test_client.get(url).json()]
+
+    assert ids("/hotels?amenity=wifi") == ["test_hotel_1", "test_hotel_2"]
+    assert ids("/hotels?amenity=WiFi,tv") == ["test_hotel_1"]
+    assert ids("/hotels?amenity=wifi&amenity=pool") == ["test_hotel_2"]
+    assert ids("/hotels?amenity=spa") == []
+
+
+@pytest.mark.asyncio
+async def test_get_hotels_by_amenity_mask(test_client, test_session, sample_hotel_data):
+    """Test amenity_match=all|any on the amenity_mask of merged hotels"""
+    test_session.add(Hotel(**sample_hotel_data))  # general: wifi, parking / room: tv, safe
+    test_session.add(Hotel(**dict(
+        sample_hotel_data, id="test_hotel_2", amenities={"general": ["pool", "BusinessCenter"], "room": ["wifi"]}
+    )))
+    await test_session.commit()
+    await index_amenities(test_session, ["test_hotel_1", "test_hotel_2"])
+    # Filters must go through the mask, the JSON of the first hotel no longer matches it
+    await test_session.execute(
+        update(Hotel).where(Hotel.id == "test_hotel_1").values(amenities={"general": [], "room": []})
+    )
+    await test_session.commit()
+
+    def ids(url):
+        return [hotel["id"] for hotel in test_client.get(url).json()]
+
+    assert ids("/hotels?amenity=wifi,tv") == ["test_hotel_1"]
+    assert ids("/hotels?amenity=business center") == ["test_hotel_2"]
+    assert ids("/hotels?amenity=tv,pool&amenity_match=any") == ["test_hotel_1", "test_hotel_2"]
+    assert ids("/hotels?amenity=spa,safe&amenity_match=any") == ["test_hotel_1"]
+    assert ids("/hotels?amenity=spa,safe") == []
+    assert test_client.get("/hotels?amenity=wifi&amenity_match=some").status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_get_hotels_by_amenity_beyond_mask(test_client, test_session, sample_hotel_data, monkeypatch):
+    """Test amenities without a mask bit are matched on the JSON under their vocabulary spelling"""
+    monkeypatch.setattr(api_module, "MASK_BITS", 0)
+    test_session.add(Hotel(**dict(sample_hotel_data, amenities={"general": ["BusinessCenter"], "room": ["tv"]})))
+    test_session.add(Hotel(**dict(sample_hotel_data, id="test_hotel_2", amenities={"general": ["pool"], "room": []})))
+    await test_session.commit()
+    await index_amenities(test_session, ["test_hotel_1", "test_hotel_2"])
+    await test_session.commit()
+
+    def ids(url):
+        return [hotel["id"] for hotel in test_client.get(url).json()]
+
+    assert ids("/hotels?amenity=business-center") == ["test_hotel_1"]
+    assert ids("/hotels?amenity=Business Center,TV") == ["test_hotel_1"]
+    assert ids("/hotels?amenity=business_center,pool&amenity_match=any") == ["test_hotel_1", "test_hotel_2"]
+    # Not in the vocabulary, no hotel can list it
+    assert ids("/hotels?amenity=spa") == []
+    assert ids("/hotels?amenity=spa,pool&amenity_match=any") == ["test_hotel_2"]
+
+
+@pytest.mark.asyncio
+async def test_get_nearby_hotels(test_client, test_session, sample_hotel_data):
+    """Test radius search returns hotels within the radius sorted by distance"""
+    # Singapore ~0.8 km, ~1.4 km and ~9 km away, Kuala Lumpur ~310 km away
+    points = {"test_hotel_1": (1.2839, 103.8515), "test_hotel_2": (1.2966, 103.8579),
+              "test_hotel_3": (1.3521, 103.8198), "test_hotel_4": (3.1390, 101.6869)}
+    for id, (lat, lng) in points.items():
+        hotel = dict(sample_hotel_data, id=id, location=dict(sample_hotel_data["location"], lat=lat, lng=lng))
+        test_session.add(Hotel(**hotel, lat=lat, lng=lng, geocell=geocell(lat, lng)))
+    await test_session.commit()
+
+    response = test_client.get("/hotels/nearby?lat=1.2838&lng=103.8591&radius_km=10")
+    assert response.status_code == status.HTTP_200_OK
+    hotels = response.json()
+    assert [hotel["id"] for hotel in hotels] == ["test_hotel_1", "test_hotel_2", "test_hotel_3"]
+    assert hotels[0]["distance_km"] < hotels[1]["distance_km"] < hotels[2]["distance_km"] <= 10
+    assert hotels[0]["name"] == sample_hotel_data["name"]
+
+    response = test_client.get("/hotels/nearby?lat=1.2838&lng=103.8591&radius_km=5&limit=1")
+    assert [hotel["id"] for hotel in response.json()] == ["test_hotel_1"]
+
+    response = test_client.get("/hotels/nearby?lat=91&lng=0&radius_km=5")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+async def test_search_hotels(test_client, test_session, sample_hotel_data):
+    """Test keyword search ranks name matches first and pages with the destination filter"""
+    hotels = [
+        ("test_hotel_1", 1, "Marina Bay Resort", "Rooftop pool"),
+        ("test_hotel_2", 1, "City Inn", "Close to the marina"),
+        ("test_hotel_3", 2, "Marina Suites", "Quiet rooms"),
+        ("test_hotel_4", 1, "Harbour View", "Sea view"),
+    ]
+    for id, destination_id, name, description in hotels:
+        test_session.add(Hotel(**dict(
+            sample_hotel_data, id=id, destination_id=destination_id, name=name, description=description
+        )))
+    await test_session.commit()
+
+    response = test_client.get("/hotels/search?q=marina")
+    assert response.status_code == status.HTTP_200_OK
+    ids = [hotel["id"] for hotel in response.json()]
+    assert set(ids) == {"test_hotel_1", "test_hotel_2", "test_hotel_3"}
+    assert ids[-1] == "test_hotel_2"  # description only match
+
+    ids, cursor = [], None
+    while True:
+        response = test_client.get("/hotels/search", params={"q": "marina", "destination": 1, "limit": 1, "cursor": cursor})
+        ids += [hotel["id"] for hotel in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert ids == ["test_hotel_1", "test_hotel_2"]
+
+    assert test_client.get("/hotels/search?q=marina pool").json()[0]["id"] == "test_hotel_1"
+    assert test_client.get("/hotels/search?q=\"'-*").json() == []
+    assert test_client.get("/hotels/search?q=marina&cursor=bm90IGpzb24").status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(test_client, test_session, sample_hotel_data):
+    """Test /hotels latencies are exported by endpoint, filter and cache status"""
+    test_session.add(Hotel(**sample_hotel_data))
+    await test_session.commit()
+    test_client.get("/hotels?destination=1&amenity=wifi")
+    test_client.get("/hotels?destination=1&amenity=wifi")
+
+    response = test_client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    labels = 'cache="{}",endpoint="/hotels",filter="amenity+destination"'
+    assert f'api_request_seconds_count{{{labels.format("miss")}}} 1' in lines
+    assert f'api_request_seconds_count{{{labels.format("hit")}}} 1' in lines
+    assert f'db_pool_connections{{state="size"}} {API_POOL_SIZE}' in lines
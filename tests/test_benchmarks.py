@@ -0,0 +1,45 @@
+import argparse
+import pytest
+from benchmarks.generate import SOURCES, iter_records, write_feeds
+from benchmarks.run import parse_size, regressions, run_pipeline
+from benchmarks.server import start_server
+
+
+def test_generated_feeds_are_seeded():
+    """Test the same seed gives the same feeds and suppliers overlap on hotel ids"""
+    assert list(iter_records('acme', 50, seed=1)) == list(iter_records('acme', 50, seed=1))
+    assert list(iter_records('acme', 50, seed=1)) != list(iter_records('acme', 50, seed=2))
+    acme = {record['Id'] for record in iter_records('acme', 200)}
+    paperflies = {record['hotel_id'] for record in iter_records('paperflies', 200)}
+    assert 0 < len(acme & paperflies) < len(acme | paperflies)
+
+
+def test_regressions():
+    """Test only records/sec drops beyond the tolerance are reported"""
+    baseline = {'1000 hotels, sqlite': [{'stage': 'merge', 'records_per_sec': 1000.0}]}
+    report = {'1000 hotels, sqlite': [{'stage': 'merge', 'records_per_sec': 850.0}]}
+    assert regressions(report, baseline, tolerance=0.2) == []
+    report['1000 hotels, sqlite'][0]['records_per_sec'] = 700.0
+    assert len(regressions(report, baseline, tolerance=0.2)) == 1
+    assert parse_size('1k') == 1000 and parse_size('1M') == 1_000_000 and parse_size('250') == 250
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline(tmp_path):
+    """Test a small end-to-end run against the local feed server and SQLite"""
+    write_feeds(str(tmp_path / 'feeds'), 30)
+    server = start_server(str(tmp_path / 'feeds'))
+    try:
+        options = argparse.Namespace(stream=True, workers=0)
+        results = await run_pipeline(
+            f"sqlite+aiosqlite:///{tmp_path / 'bench.db'}", f'http://127.0.0.1:{server.server_address[1]}', options
+        )
+    finally:
+        server.shutdown()
+    stages = {row['stage']: row for row in results}
+    assert list(stages) == [f'ingest {source}' for source in SOURCES] + ['merge', 'sensor, 304', 'sensor, unchanged']
+    assert 0 < stages['merge']['records'] <= 30
+    # One validator read per feed, then one claim finds the merge queue empty
+    assert stages['sensor, 304']['round_trips'] == len(SOURCES) + 1
+    # Unchanged records are parsed again but neither written nor merged
+    assert stages['sensor, unchanged']['round_trips'] == len(SOURCES) + 1
@@ -0,0 +1,38 @@
+from geo import bounding_box, geocell, haversine_km
+
+
+def test_haversine_km():
+    """Test great-circle distances against known values"""
+    assert haversine_km(1.0, 2.0, 1.0, 2.0) == 0
+    assert round(haversine_km(0, 0, 0, 1), 1) == 111.2
+    assert round(haversine_km(1.3521, 103.8198, 3.1390, 101.6869)) == 309
+
+
+def test_geocell():
+    """Test points map to latitude bands and invalid coordinates have no cell"""
+    assert geocell(-90, 0) == 0
+    assert geocell(1.0, 2.0) == 910
+    assert geocell(None, 2.0) is None
+    assert geocell(91, 0) is None
+
+
+def test_bounding_box_covers_radius():
+    """Test every point within the radius falls in the box"""
+    cells, min_lat, max_lat, lng_ranges = bounding_box(45.0, 10.0, 50)
+    for lat, lng in [(45.44, 10.0), (44.56, 10.0), (45.0, 10.63), (45.0, 9.37)]:
+        assert haversine_km(45.0, 10.0, lat, lng) <= 50
+        assert geocell(lat, lng) in cells
+        assert min_lat <= lat <= max_lat
+        assert any(low <= lng <= high for low, high in lng_ranges)
+
+
+def test_bounding_box_antimeridian_and_poles():
+    """Test boxes crossing the antimeridian are split and boxes reaching a pole span all longitudes"""
+    _, _, _, lng_ranges = bounding_box(0.0, 179.95, 20)
+    assert len(lng_ranges) == 2
+    assert lng_ranges[0][1] == 180.0 and lng_ranges[1][0] == -180.0
+    assert any(low <= -179.95 <= high for low, high in lng_ranges)
+
+    _, _, max_lat, lng_ranges = bounding_box(89.95, 0.0, 20)
+    assert max_lat == 90.0
+    assert lng_ranges is None
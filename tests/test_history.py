@@ -0,0 +1,67 @@
+import pytest
+from datetime import date, datetime, timezone
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from history import archive_attributes, compact_history, partition_name
+from models import HotelAttribute, HotelAttributeHistory
+
+
+@pytest.mark.asyncio
+async def test_archive_attributes(test_session):
+    """Test the current versions of the given records are copied into the history"""
+    valid_from = datetime(2025, 7, 1, tzinfo=timezone.utc)
+    test_session.add_all([
+        HotelAttribute(hotel_id='h1', source='acme', attributes={"name": "Old"},
+                       content_hash='old', updated_at=valid_from),
+        HotelAttribute(hotel_id='h2', source='acme', attributes={"name": "Kept"}, content_hash='kept'),
+        HotelAttribute(hotel_id='h1', source='patagonia', attributes={"name": "Other"}, content_hash='other'),
+    ])
+    await test_session.commit()
+
+    archived_at = datetime(2025, 7, 2, tzinfo=timezone.utc)
+    await archive_attributes(test_session, 'acme', ['h1', 'missing'], archived_at)
+    await test_session.commit()
+
+    history = (await test_session.execute(select(HotelAttributeHistory))).scalars().all()
+    assert [(row.hotel_id, row.source, row.content_hash) for row in history] == [('h1', 'acme', 'old')]
+    assert history[0].attributes == {"name": "Old"}
+    assert history[0].valid_from.replace(tzinfo=timezone.utc) == valid_from
+    assert history[0].archived_at.replace(tzinfo=timezone.utc) == archived_at
+
+
+@pytest.mark.asyncio
+async def test_compact_history(test_session):
+    """Test versions archived before the retention window are deleted"""
+    test_session.add_all([
+        HotelAttributeHistory(hotel_id='h1', source='acme', attributes='{}', content_hash=str(day),
+                              archived_at=datetime(2025, 7, day, 12, tzinfo=timezone.utc))
+        for day in (1, 10, 20)
+    ])
+    await test_session.commit()
+
+    await compact_history(test_session, retention_days=10, today=date(2025, 7, 20))
+    await test_session.commit()
+
+    result = await test_session.execute(select(HotelAttributeHistory.content_hash).order_by(HotelAttributeHistory.archived_at))
+    assert result.scalars().all() == ['10', '20']
+
+
+def test_partition_name():
+    """Test daily partitions are named after their day"""
+    assert partition_name(date(2025, 7, 1)) == 'hotel_attribute_history_20250701'
+
+
+@pytest.mark.postgres
+@pytest.mark.asyncio
+async def test_archive_creates_missing_partition(postgres_engine):
+    """Test archiving into a day without a partition creates it instead of failing the ingest"""
+    archived_at = datetime(2031, 1, 15, 12, tzinfo=timezone.utc)
+    async with sessionmaker(postgres_engine, class_=AsyncSession)() as session:
+        session.add(HotelAttribute(hotel_id='h1', source='acme', attributes={"name": "Old"}, content_hash='old'))
+        await session.commit()
+        await archive_attributes(session, 'acme', ['h1'], archived_at)
+        await session.commit()
+
+        result = await session.execute(text(f"SELECT content_hash FROM {partition_name(archived_at.date())}"))
+        assert result.scalars().all() == ['old']
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import httpx
+import pytest
+from http_client import RateLimiter, SupplierClient, iter_json_array
+
+URL = "https://suppliers.example.com/acme"
+
+
+def make_client(handler, **kwargs):
+    kwargs.setdefault("backoff", 0)
+    return SupplierClient(transport=httpx.MockTransport(handler), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_supplier_client_retries_server_errors():
+    """Test 5xx responses are retried until the supplier recovers"""
+    statuses = iter([503, 502, 200])
+
+    def handler(request):
+        return httpx.Response(next(statuses), json=[])
+
+    client = make_client(handler, retries=3)
+    response = await client.request("GET", URL)
+    assert response.status_code == 200
+    await client.aclose()
+    assert client.client is None
+
+
+@pytest.mark.asyncio
+async def test_supplier_client_gives_up_after_retries():
+    """Test the last response or error is surfaced once retries run out"""
+    attempts = []
+
+    def failing(request):
+        attempts.append(request)
+        return httpx.Response(500)
+
+    client = make_client(failing, retries=2)
+    response = await client.request("GET", URL)
+    assert response.status_code == 500
+    assert len(attempts) == 3
+
+    def timing_out(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    client = make_client(timing_out, retries=1)
+    with pytest.raises(httpx.ReadTimeout):
+        await client.request("GET", URL)
+
+
+@pytest.mark.asyncio
+async def test_supplier_client_limits_concurrency_per_source():
+    """Test a source never has more in-flight requests than its limit"""
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200)
+
+    client = make_client(handler, concurrency=4)
+    client.configure("acme", concurrency=2)
+    await asyncio.gather(*[client.request("GET", URL, key="acme") for _ in range(6)])
+    assert peak == 2
+
+
+def test_retry_delay_honours_retry_after():
+    """Test backoff is capped and Retry-After is respected"""
+    client = SupplierClient(backoff=1, max_backoff=4)
+    assert 0 <= client.retry_delay(10) <= 4
+    assert client.retry_delay(0, httpx.Response(429, headers={"Retry-After": "3"})) >= 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_spaces_requests():
+    """Test the rate limiter enforces the configured interval"""
+    limiter = RateLimiter(rate=100)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for _ in range(3):
+        await limiter.wait()
+    assert loop.time() - start >= 0.02
+
+
+async def byte_chunks(body: bytes, size: int):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+async def parse(body: bytes, size: int = 1):
+    return [item async for item in iter_json_array(byte_chunks(body, size))]
+
+
+@pytest.mark.asyncio
+async def test_iter_json_array_incremental():
+    """Test array items are decoded across arbitrary chunk boundaries"""
+    items = [{"name": "Café Ünïcode", "lat": 1.2345}, 12345, "x", None, [1, 2], {}]
+    body = json.dumps(items, ensure_ascii=False).encode()
+    for size in (1, 3, 64):
+        assert await parse(body, size) == items
+    assert await parse(b" [ ] ") == []
+
+
+@pytest.mark.asyncio
+async def test_iter_json_array_rejects_invalid_feeds():
+    """Test objects and truncated arrays raise instead of yielding partial data"""
+    with pytest.raises(ValueError):
+        await parse(b'{"id": 1}')
+    with pytest.raises(ValueError):
+        await parse(b'[{"id": 1}, {"id"', 4)
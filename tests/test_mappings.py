@@ -0,0 +1,96 @@
+import json
+import pytest
+from mappings import SupplierSpec, compile_spec, load_suppliers, to_float
+from models import AmenitiesSerializer, ImageSerializer, LocationSerializer
+from tests.test_scraper import ACME_RESPONSE, PATAGONIA_RESPONSE, PAPERFLIES_RESPONSE
+
+SUPPLIERS = load_suppliers(None)
+
+
+def test_acme_mapping_matches_serializers():
+    """Test the compiled acme mapper produces what the serializers produced"""
+    record = ACME_RESPONSE[0]
+    attributes = compile_spec(SUPPLIERS['acme'])(record)
+    assert attributes == {
+        "id": "acme_1",
+        "destination_id": 1,
+        "name": "Acme Hotel",
+        "description": "A test hotel from Acme",
+        "location": LocationSerializer(
+            lat=record["Latitude"], lng=record["Longitude"], address=record["Address"],
+            city=record["City"], country=record["Country"], postal_code=record["PostalCode"]
+        ).model_dump(),
+        "amenities": AmenitiesSerializer(general=record["Facilities"]).model_dump(),
+        "images": ImageSerializer().model_dump(),
+        "booking_conditions": []
+    }
+
+
+def test_patagonia_mapping_renames_image_keys():
+    """Test image url/description pairs become link/description"""
+    attributes = compile_spec(SUPPLIERS['patagonia'])(PATAGONIA_RESPONSE[0])
+    assert attributes["images"] == {
+        "rooms": [{"link": "room.jpg", "description": "Room"}],
+        "site": [{"link": "site.jpg", "description": "Site"}],
+        "amenities": []
+    }
+    assert attributes["location"]["lat"] == 1.234
+    assert attributes["location"]["city"] is None
+    assert attributes["amenities"] == {"general": ["parking", "restaurant"], "room": []}
+
+
+def test_paperflies_mapping_reads_nested_paths():
+    """Test nested supplier paths and caption keys are extracted"""
+    attributes = compile_spec(SUPPLIERS['paperflies'])(PAPERFLIES_RESPONSE[0])
+    assert attributes["location"]["country"] == "PF Country"
+    assert attributes["amenities"] == {"general": ["pool", "spa"], "room": ["tv", "safe"]}
+    assert attributes["images"]["rooms"] == [{"link": "room.jpg", "description": "Room"}]
+    assert attributes["booking_conditions"] == ["No smoking"]
+
+    # Missing nested objects map to empty values instead of raising
+    sparse = compile_spec(SUPPLIERS['paperflies'])({"hotel_id": "pf_2", "location": None})
+    assert sparse["location"]["lat"] is None
+    assert sparse["amenities"] == {"general": [], "room": []}
+    assert sparse["images"] == {"rooms": [], "site": [], "amenities": []}
+    assert sparse["booking_conditions"] == []
+
+
+def test_to_float():
+    """Test coordinates are coerced like LocationSerializer"""
+    assert to_float("") is None
+    assert to_float("1.5") == 1.5
+    assert to_float(2) == 2.0
+    assert to_float("n/a") is None
+
+
+def test_load_suppliers_from_file(tmp_path):
+    """Test new suppliers are added through a JSON spec file"""
+    path = tmp_path / "suppliers.json"
+    path.write_text(json.dumps([{
+        "name": "globex",
+        "url": "https://suppliers.example.com/globex",
+        "priority": 5,
+        "fields": {"id": "code", "name": "title", "location.lat": "geo.lat"},
+        "transforms": {"name": "title"},
+        "images": {"path": "media", "link": "src", "caption": "alt"}
+    }]))
+    suppliers = load_suppliers(str(path))
+    assert set(suppliers) == {"acme", "patagonia", "paperflies", "globex"}
+
+    attributes = compile_spec(suppliers["globex"])({
+        "code": "g1",
+        "title": "grand hotel",
+        "geo": {"lat": "3.5"},
+        "media": {"site": [{"src": "a.jpg", "alt": "Front"}, {"alt": "no link"}]}
+    })
+    assert attributes["id"] == "g1"
+    assert attributes["name"] == "Grand Hotel"
+    assert attributes["location"]["lat"] == 3.5
+    assert attributes["images"]["site"] == [{"link": "a.jpg", "description": "Front"}]
+
+
+def test_unknown_transform_is_rejected():
+    """Test a spec naming an unknown transform fails when compiled"""
+    spec = SupplierSpec(name="x", url="https://x", fields={"name": "n"}, transforms={"name": "nope"})
+    with pytest.raises(KeyError):
+        compile_spec(spec)
@@ -0,0 +1,100 @@
+import asyncio
+import pytest
+from sqlalchemy import select, update
+from merge_queue import claim, complete, consume, count_parked, enqueue, release
+from models import Hotel, HotelAttribute, MergeBatch
+from tests.test_scraper import mock_scraper
+
+
+@pytest.mark.asyncio
+async def test_enqueue_and_claim(test_session):
+    """Test batches are claimed once, in order, and handed out again when their claim expires"""
+    assert await enqueue(test_session, ["h3", "h1", "h2", "h1"], batch_size=2) == 2
+    await test_session.commit()
+
+    first = await claim(test_session, "worker-1")
+    second = await claim(test_session, "worker-2")
+    assert first[1] == ["h1", "h2"]
+    assert second[1] == ["h3"]
+    assert await claim(test_session, "worker-3") is None
+
+    # A worker that died holding a batch loses it after the visibility timeout
+    reclaimed = await claim(test_session, "worker-3", visibility_timeout=0)
+    assert reclaimed == first
+    test_session.expire_all()
+    batch = await test_session.get(MergeBatch, first[0])
+    assert (batch.claimed_by, batch.attempts) == ("worker-3", 2)
+
+    await complete(test_session, first[0])
+    # A failed batch is retried after a delay, not right away by the worker that just failed it
+    await release(test_session, second[0])
+    assert await claim(test_session, "worker-1") is None
+    await release(test_session, second[0], retry_delay=0)
+    assert await claim(test_session, "worker-1") == second
+    # Batches past max_attempts are left for inspection
+    assert await count_parked(test_session, max_attempts=2) == 0
+    await release(test_session, second[0], retry_delay=0)
+    assert await claim(test_session, "worker-1", max_attempts=2) is None
+    assert await count_parked(test_session, max_attempts=2) == 1
+
+
+@pytest.mark.asyncio
+async def test_consume_merges_queued_hotels(test_session, mock_scraper):
+    """Test scraped hotels are queued instead of merged, then merged by a consumer"""
+    mock_scraper.merge_queue = True
+    for scrape in (mock_scraper.acme_scraper, mock_scraper.patagonia_scraper, mock_scraper.paperflies_scraper):
+        await scrape()
+    await mock_scraper.schedule_merge()
+    assert (await test_session.execute(select(Hotel))).all() == []
+
+    stopping = asyncio.Event()
+    consumer = asyncio.create_task(consume(mock_scraper, "worker-1", stopping, poll_interval=0.01))
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        test_session.expire_all()
+        if not (await test_session.execute(select(MergeBatch))).all():
+            break
+    stopping.set()
+    await asyncio.wait_for(consumer, 1)
+
+    assert (await test_session.execute(select(MergeBatch))).all() == []
+    ids = (await test_session.execute(select(Hotel.id).order_by(Hotel.id))).scalars().all()
+    assert ids == ["acme_1", "pat_1", "pf_1"]
+
+
+@pytest.mark.asyncio
+async def test_overlapping_batches_merge_one_after_the_other(test_session, mock_scraper):
+    """Test a batch merging hotels another merge already read waits for it, so the newest attributes are kept"""
+    def attributes(name):
+        return {"name": name, "location": {"lat": 1.0, "lng": 1.0}, "amenities": {}, "images": {}}
+
+    test_session.add_all([
+        HotelAttribute(hotel_id="h1", source="acme", attributes=attributes("Old")),
+        HotelAttribute(hotel_id="h2", source="acme", attributes=attributes("Other")),
+    ])
+    await test_session.commit()
+
+    # The first merge stops between reading the attributes and writing the hotels
+    read, resume = asyncio.Event(), asyncio.Event()
+    upsert_hotels = mock_scraper.upsert_hotels
+
+    async def paused_upsert_hotels(session, hotels):
+        if not read.is_set():
+            read.set()
+            await resume.wait()
+        await upsert_hotels(session, hotels)
+
+    mock_scraper.upsert_hotels = paused_upsert_hotels
+    first = asyncio.create_task(mock_scraper.data_merging(["h1", "h2"]))
+    await asyncio.wait_for(read.wait(), 1)
+    await test_session.execute(
+        update(HotelAttribute).where(HotelAttribute.hotel_id == "h1").values(attributes=attributes("New"))
+    )
+    await test_session.commit()
+    second = asyncio.create_task(mock_scraper.data_merging(["h1"]))
+    await asyncio.sleep(0.05)
+    resume.set()
+    await asyncio.wait_for(asyncio.gather(first, second), 1)
+
+    test_session.expire_all()
+    assert (await test_session.get(Hotel, "h1")).name == "New"
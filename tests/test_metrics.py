@@ -0,0 +1,37 @@
+import pytest
+from metrics import Registry, timed
+
+
+def test_render_prometheus_text():
+    """Test counters and cumulative histogram buckets in the text exposition format"""
+    registry = Registry()
+    fetched = registry.counter('fetched_bytes_total', 'Bytes fetched')
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+    fetched.inc(512, source='acme')
+    fetched.inc(512, source='acme')
+    latency.observe(0.05, endpoint='/hotels')
+    latency.observe(0.5, endpoint='/hotels')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE fetched_bytes_total counter' in lines
+    assert 'fetched_bytes_total{source="acme"} 1024' in lines
+    assert 'latency_seconds_bucket{endpoint="/hotels",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{endpoint="/hotels",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{endpoint="/hotels",le="+Inf"} 2' in lines
+    assert 'latency_seconds_count{endpoint="/hotels"} 2' in lines
+    assert registry.summary()['latency_seconds'] == {'{endpoint="/hotels"}': {'count': 2, 'seconds': 0.55}}
+
+
+@pytest.mark.asyncio
+async def test_timed_counts_failures():
+    """Test decorated stages are timed per source and failures are counted"""
+    from metrics import STAGE_ERRORS, STAGE_SECONDS
+
+    @timed('test')
+    async def failing(source):
+        raise ValueError(source)
+
+    with pytest.raises(ValueError):
+        await failing('acme')
+    assert STAGE_ERRORS.get(stage='test', source='acme') == 1
+    assert STAGE_SECONDS.summary()['{source="acme",stage="test"}']['count'] == 1
@@ -0,0 +1,51 @@
+import html
+import re
+from sanitize import cached_clean_string, clean_string, sanitize_data, sanitize_string
+
+
+def reference_sanitize(s: str) -> str:
+    s = html.unescape(s.strip())
+    s = re.sub(r'<script\b[^>]*>.*?</script>', '', s, flags=re.IGNORECASE | re.DOTALL)
+    return re.sub(r'<[^>]+>', '', s)
+
+
+def test_clean_string_matches_reference():
+    """Test the fast path gives the same result as the full unescape and strip"""
+    samples = [
+        "  plain text  ",
+        "Bed &amp; Breakfast",
+        "<b>Bold</b> move",
+        "<SCRIPT type='x'>alert(1)</SCRIPT>after",
+        "&lt;i&gt;escaped tag&lt;/i&gt;",
+        "a < b and c > d",
+        "",
+    ]
+    for sample in samples:
+        assert clean_string(sample) == reference_sanitize(sample)
+        assert sanitize_string(sample) == reference_sanitize(sample)
+
+
+def test_sanitize_data_keeps_clean_containers():
+    """Test untouched dicts and lists are returned as is"""
+    record = {"name": "Clean", "tags": ["wifi", "pool"], "location": {"lat": 1.0}}
+    assert sanitize_data(record) is record
+
+    dirty = {"name": "Clean", "tags": ["wifi", " pool "], "location": {"lat": 1.0}}
+    cleaned = sanitize_data(dirty)
+    assert cleaned is not dirty
+    assert cleaned["tags"] == ["wifi", "pool"]
+    assert cleaned["location"] is dirty["location"]
+    assert dirty["tags"] == ["wifi", " pool "]
+
+
+def test_short_strings_are_cached():
+    """Test repeated short values are cleaned once and share one object"""
+    cached_clean_string.cache_clear()
+    first = sanitize_string("Business &amp; Center")
+    second = sanitize_string("".join(["Business ", "&amp; Center"]))
+    assert first is second
+    assert cached_clean_string.cache_info().hits == 1
+
+    long_value = "x" * 500
+    sanitize_string(long_value)
+    assert cached_clean_string.cache_info().currsize == 1
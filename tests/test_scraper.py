@@ -1,9 +1,12 @@
 import pytest
 import json
+import httpx
 from scraper import Scraper
-from models import HotelAttribute
-from models import Hotel
-from sqlalchemy import select
+from models import HotelAttribute, HotelAttributeHistory
+from models import Base, Hotel, MergeBatch, MergeGeneration
+from sqlalchemy import select, text, update
+from search import search_query
+from metrics import REGISTRY
 import scraper as scraper_module  # Import the module to mock AsyncSessionLocal
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
@@ -103,11 +106,14 @@ async def test_acme_scraper(test_session, mock_scraper):
     hotel_attr = hotel_attrs[0]
     assert hotel_attr.hotel_id == "acme_1"
     
-    attributes = json.loads(hotel_attr.attributes)
+    attributes = hotel_attr.attributes
     assert attributes["name"] == "Acme Hotel"
     assert attributes["destination_id"] == 1
     assert attributes["location"]["lat"] == 1.234
     assert "wifi" in attributes["amenities"]["general"]
+    # Stored as a JSON object, not as JSON text wrapped in a string
+    stored_type = await test_session.execute(text("SELECT json_type(attributes) FROM hotel_attributes"))
+    assert stored_type.scalar_one() == "object"
 
 @pytest.mark.asyncio
 async def test_patagonia_scraper(test_session, mock_scraper):
@@ -123,7 +129,7 @@ async def test_patagonia_scraper(test_session, mock_scraper):
     hotel_attr = hotel_attrs[0]
     assert hotel_attr.hotel_id == "pat_1"
     
-    attributes = json.loads(hotel_attr.attributes)
+    attributes = hotel_attr.attributes
     assert attributes["name"] == "Patagonia Hotel"
     assert attributes["destination_id"] == 1
     assert len(attributes["images"]["rooms"]) == 1
@@ -143,7 +149,7 @@ async def test_paperflies_scraper(test_session, mock_scraper):
     hotel_attr = hotel_attrs[0]
     assert hotel_attr.hotel_id == "pf_1"
     
-    attributes = json.loads(hotel_attr.attributes)
+    attributes = hotel_attr.attributes
     assert attributes["name"] == "Paperflies Hotel"
     assert attributes["destination_id"] == 1
     assert attributes["booking_conditions"] == ["No smoking"]
@@ -153,16 +159,13 @@ async def test_paperflies_scraper(test_session, mock_scraper):
 @pytest.mark.asyncio
 async def test_mapper_with_multiple_sources(test_session, mock_scraper):
     """Test mapping data from multiple sources"""
-    # Scrape data from all sources and collect hotel IDs
-    acme_ids = await mock_scraper.acme_scraper()
-    patagonia_ids = await mock_scraper.patagonia_scraper()
-    paperflies_ids = await mock_scraper.paperflies_scraper()
+    # Scrape data from all sources, each queues its changed hotels
+    assert await mock_scraper.acme_scraper() == 1
+    assert await mock_scraper.patagonia_scraper() == 1
+    assert await mock_scraper.paperflies_scraper() == 1
 
-    # Combine all hotel IDs
-    all_hotel_ids = list(set(acme_ids + patagonia_ids + paperflies_ids))
-    
-    # Run the mapper with collected IDs
-    await mock_scraper.data_merging(all_hotel_ids)
+    # Merge the queued hotels
+    await mock_scraper.schedule_merge()
     
     # Verify the mapped data
     result = await test_session.execute(select(Hotel))
@@ -192,4 +195,264 @@ async def test_sanitize_data():
     sanitized = scraper.sanitize_data(test_data)
     assert sanitized["name"] == "Test & Hotel"
     assert sanitized["description"] == "Description"
-    assert sanitized["nested"]["text"] == 'Nested "quoted" text' 
\ No newline at end of file
+    assert sanitized["nested"]["text"] == 'Nested "quoted" text' 
+
+@pytest.mark.asyncio
+async def test_data_merging_is_idempotent(test_session, mock_scraper):
+    """Test merging the same hotel ids twice updates instead of failing"""
+    await mock_scraper.acme_scraper()
+    await mock_scraper.patagonia_scraper()
+    await mock_scraper.paperflies_scraper()
+    hotel_ids = ["acme_1", "pat_1", "pf_1"]
+
+    await mock_scraper.data_merging(hotel_ids, chunk_size=2)
+    await mock_scraper.data_merging(hotel_ids, chunk_size=2)
+
+    result = await test_session.execute(select(Hotel))
+    assert len(result.scalars().all()) == 3
+
+    # Every merge bumps the generation the API caches are keyed on
+    generation = await test_session.get(MergeGeneration, 1)
+    assert generation.generation == 2
+
+
+@pytest.mark.asyncio
+async def test_data_merging_source_priority(test_session, mock_scraper):
+    """Test the merge picks non-empty values by source priority"""
+    async with mock_scraper.session_factory() as session:
+        session.add_all([
+            HotelAttribute(hotel_id='h1', source='acme', attributes={
+                "destination_id": 1, "name": "Acme Name", "description": "Acme",
+                "location": {"lat": 1.0, "lng": 2.0, "address": "Acme St", "country": "SG"},
+                "amenities": {"general": ["pool"], "room": ["tv"]},
+                "images": {"rooms": [], "site": [], "amenities": []},
+                "booking_conditions": []
+            }),
+            HotelAttribute(hotel_id='h1', source='paperflies', attributes={
+                "destination_id": 1, "name": "", "description": "Paperflies",
+                "location": {"lat": None, "lng": None, "address": "PF St", "country": None},
+                "amenities": {"general": [], "room": ["safe"]},
+                "images": {"rooms": [{"link": "r.jpg", "description": "Room"}], "site": [], "amenities": []},
+                "booking_conditions": ["No pets"]
+            }),
+        ])
+        await session.commit()
+
+    await mock_scraper.data_merging(['h1'])
+
+    hotel = (await test_session.execute(select(Hotel).where(Hotel.id == 'h1'))).scalar_one()
+    assert hotel.name == "Acme Name"
+    assert hotel.description == "Paperflies"
+    assert hotel.location == {"lat": 1.0, "lng": 2.0, "address": "PF St", "country": "SG"}
+    assert hotel.amenities == {"general": ["pool"], "room": ["safe"]}
+    assert hotel.images["rooms"] == [{"link": "r.jpg", "description": "Room"}]
+    assert hotel.booking_conditions == ["No pets"]
+    assert json.loads(hotel.document)["location"] == hotel.location
+    assert (hotel.lat, hotel.lng, hotel.geocell) == (1.0, 2.0, 910)
+
+    # The merged name is searchable right away
+    query, _ = search_query(test_session.bind.dialect.name, "acme name")
+    assert (await test_session.execute(query)).scalars().all() == ['h1']
+
+
+@pytest.mark.asyncio
+async def test_unchanged_records_are_skipped(test_session, mock_scraper, monkeypatch):
+    """Test records with an unchanged content hash are not stored or re-merged"""
+    assert await mock_scraper.acme_scraper() == 1
+    assert await mock_scraper.acme_scraper() == 0
+
+    # A changed record replaces the current one, the previous version is archived
+    async def changed_request(method: str, url: str):
+        return [dict(ACME_RESPONSE[0], Name="Acme Hotel Renamed")]
+
+    monkeypatch.setattr(mock_scraper, "async_request", changed_request)
+    assert await mock_scraper.acme_scraper() == 1
+
+    result = await test_session.execute(
+        select(HotelAttribute).where(HotelAttribute.hotel_id == "acme_1")
+    )
+    assert len(result.scalars().all()) == 1
+    result = await test_session.execute(
+        select(HotelAttributeHistory).where(HotelAttributeHistory.hotel_id == "acme_1")
+    )
+    assert len(result.scalars().all()) == 1
+
+    await mock_scraper.data_merging(["acme_1"])
+    hotel = (await test_session.execute(select(Hotel).where(Hotel.id == "acme_1"))).scalar_one()
+    assert hotel.name == "Acme Hotel Renamed"
+
+
+@pytest.mark.asyncio
+async def test_sensor_fetches_each_source_once(test_session, mock_scraper):
+    """Test the sensor hands its payload to the scrapers and honours 304 responses"""
+    REGISTRY.reset()
+    payloads = {'acme': ACME_RESPONSE, 'patagonia': PATAGONIA_RESPONSE, 'paperflies': PAPERFLIES_RESPONSE}
+    calls = []
+
+    async def mock_async_send(method: str, url: str, headers=None, source=None, stream=False):
+        calls.append((url, headers))
+        source = url.rsplit('/', 1)[-1]
+        request = httpx.Request(method, url)
+        if headers and headers.get('If-None-Match') == f'"{source}-v1"':
+            return httpx.Response(304, request=request)
+        return httpx.Response(200, json=payloads[source], headers={'ETag': f'"{source}-v1"'}, request=request)
+
+    mock_scraper.async_send = mock_async_send
+
+    await mock_scraper.sensor()
+    assert len(calls) == 3
+    assert all(not headers for _, headers in calls)
+    result = await test_session.execute(select(Hotel))
+    assert len(result.scalars().all()) == 3
+
+    # The second run sends the stored validators and skips every source on 304
+    calls.clear()
+    await mock_scraper.sensor()
+    assert len(calls) == 3
+    assert all(headers['If-None-Match'].endswith('-v1"') for _, headers in calls)
+    result = await test_session.execute(select(HotelAttribute))
+    assert len(result.scalars().all()) == 3
+
+    summary = REGISTRY.summary()
+    assert summary['pipeline_stage_seconds']['{source="acme",stage="supplier"}']['count'] == 2
+    assert summary['pipeline_records_total']['{source="acme",stage="write"}'] == 1
+    assert summary['pipeline_records_total']['{stage="merge"}'] == 3
+
+
+@pytest.mark.asyncio
+async def test_validators_are_reset_with_the_database(test_engine, test_session, mock_scraper):
+    """Test validators live in the database, an emptied database gets every feed in full again"""
+    payloads = {'acme': ACME_RESPONSE, 'patagonia': PATAGONIA_RESPONSE, 'paperflies': PAPERFLIES_RESPONSE}
+    calls = []
+
+    async def mock_async_send(method: str, url: str, headers=None, source=None, stream=False):
+        calls.append(headers)
+        source = url.rsplit('/', 1)[-1]
+        request = httpx.Request(method, url)
+        if headers:
+            return httpx.Response(304, request=request)
+        return httpx.Response(200, json=payloads[source], request=request, headers={
+            'ETag': f'"{source}-v1"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'
+        })
+
+    mock_scraper.async_send = mock_async_send
+    await mock_scraper.sensor()
+    assert await mock_scraper.conditional_headers(mock_scraper.sources['acme']) == {
+        'If-None-Match': '"acme-v1"', 'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'
+    }
+
+    async with test_engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            await conn.execute(table.delete())
+    calls.clear()
+    await mock_scraper.sensor()
+    assert calls == [{}, {}, {}]
+    ids = (await test_session.execute(select(Hotel.id).order_by(Hotel.id))).scalars().all()
+    assert ids == ["acme_1", "pat_1", "pf_1"]
+
+    # A version served without validators drops the stored ones
+    await mock_scraper.store_validators(mock_scraper.sources['acme'], httpx.Response(200))
+    assert await mock_scraper.conditional_headers(mock_scraper.sources['acme']) == {}
+
+
+@pytest.mark.asyncio
+async def test_failed_merge_is_retried_by_the_next_run(test_session, mock_scraper, monkeypatch):
+    """Test hotels whose merge failed stay queued and are merged by the next run, though their hashes are stored"""
+    payloads = {'acme': ACME_RESPONSE, 'patagonia': PATAGONIA_RESPONSE, 'paperflies': PAPERFLIES_RESPONSE}
+
+    async def mock_async_send(method: str, url: str, headers=None, source=None, stream=False):
+        return httpx.Response(200, json=payloads[url.rsplit('/', 1)[-1]], request=httpx.Request(method, url))
+
+    async def failing_merge_chunk(session, hotel_ids):
+        raise RuntimeError("database went away")
+
+    mock_scraper.async_send = mock_async_send
+    merge_chunk = mock_scraper.merge_chunk
+    monkeypatch.setattr(mock_scraper, "merge_chunk", failing_merge_chunk)
+    await mock_scraper.sensor()
+    assert (await test_session.execute(select(Hotel))).all() == []
+    queued = (await test_session.execute(select(MergeBatch.hotel_ids))).scalars().all()
+    assert sorted(id for ids in queued for id in ids) == ["acme_1", "pat_1", "pf_1"]
+
+    # Once the retry delay has passed the next run merges them, although no record changed
+    monkeypatch.setattr(mock_scraper, "merge_chunk", merge_chunk)
+    await test_session.execute(update(MergeBatch).values(claimed_at=None))
+    await test_session.commit()
+    await mock_scraper.sensor()
+    ids = (await test_session.execute(select(Hotel.id).order_by(Hotel.id))).scalars().all()
+    assert ids == ["acme_1", "pat_1", "pf_1"]
+    assert (await test_session.execute(select(MergeBatch))).all() == []
+
+
+@pytest.mark.asyncio
+async def test_sensor_streaming_mode(test_session, mock_scraper):
+    """Test streamed feeds are parsed incrementally and flushed chunk by chunk"""
+    records = [dict(PAPERFLIES_RESPONSE[0], hotel_id=f"pf_{i}") for i in range(5)]
+    body = json.dumps(records).encode()
+
+    async def mock_async_send(method: str, url: str, headers=None, source=None, stream=False):
+        assert stream
+        request = httpx.Request(method, url)
+        if source != 'paperflies':
+            return httpx.Response(200, content=b"[]", request=request)
+        return httpx.Response(200, content=body, request=request)
+
+    flushed = []
+    save_attributes = mock_scraper.save_attributes
+
+    async def spy_save_attributes(source, rows):
+        flushed.append(len(rows))
+        return await save_attributes(source, rows)
+
+    mock_scraper.async_send = mock_async_send
+    mock_scraper.save_attributes = spy_save_attributes
+    mock_scraper.streaming = True
+    mock_scraper.ingest_chunk_size = 2
+
+    await mock_scraper.sensor()
+    assert flushed == [2, 2, 1]
+    result = await test_session.execute(select(Hotel))
+    assert sorted(h.id for h in result.scalars().all()) == [f"pf_{i}" for i in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_mapping_in_worker_processes(test_session, mock_scraper):
+    """Test records are cleaned and mapped in a process pool when enabled"""
+    records = [dict(ACME_RESPONSE[0], Id=f"acme_{i}", Name=f" Acme &amp; Co {i} ") for i in range(10)]
+    mock_scraper.mapping_workers = 2
+    mock_scraper.ingest_chunk_size = 3
+    try:
+        changed = await mock_scraper.scrape('acme', records)
+    finally:
+        await mock_scraper.close()
+    assert mock_scraper.executor is None
+    assert changed == 10
+
+    result = await test_session.execute(
+        select(HotelAttribute).where(HotelAttribute.hotel_id == "acme_7")
+    )
+    attributes = result.scalar_one().attributes
+    assert attributes["name"] == "Acme & Co 7"
+
+
+@pytest.mark.asyncio
+async def test_save_attributes_writes_in_batches(test_session, mock_scraper):
+    """Test changed rows are bulk written and committed batch by batch"""
+    batches = []
+    write_attributes = mock_scraper.write_attributes
+
+    async def spy_write_attributes(session, rows):
+        batches.append(len(rows))
+        await write_attributes(session, rows)
+
+    mock_scraper.write_attributes = spy_write_attributes
+    mock_scraper.ingest_chunk_size = 2
+    rows = [(f"h{i}", json.dumps({"id": f"h{i}"}), f"hash{i}") for i in range(5)]
+
+    assert await mock_scraper.save_attributes('acme', rows) == [f"h{i}" for i in range(5)]
+    assert batches == [2, 2, 1]
+    result = await test_session.execute(select(HotelAttribute))
+    stored = result.scalars().all()
+    assert len(stored) == 5
+    assert stored[0].attributes == {"id": "h0"}
+    assert stored[0].content_hash == "hash0"
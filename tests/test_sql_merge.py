@@ -0,0 +1,99 @@
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from benchmarks.generate import SOURCES, iter_records
+from models import Hotel, HotelAttribute, render_hotel
+from sql_merge import postgresql_statement
+from tests.test_scraper import mock_scraper
+
+COMPARED_COLUMNS = ['id', 'destination_id', 'name', 'description', 'booking_conditions',
+                    'location', 'amenities', 'images', 'document', 'lat', 'lng', 'geocell']
+
+
+async def merged_hotels(session):
+    session.expire_all()
+    result = await session.execute(select(Hotel).order_by(Hotel.id))
+    return [{column: getattr(hotel, column) for column in COMPARED_COLUMNS} for hotel in result.scalars()]
+
+
+@pytest.fixture
+def postgres_scraper(mock_scraper, postgres_engine):
+    """The mock scraper bound to the Postgres database in TEST_POSTGRES_URL"""
+    mock_scraper.session_factory = sessionmaker(postgres_engine, class_=AsyncSession, expire_on_commit=False)
+    return mock_scraper
+
+
+async def assert_sql_merge_matches_python_merge(scraper):
+    for source in SOURCES:
+        await scraper.scrape(source, list(iter_records(source, 300, seed=7)))
+    async with scraper.session_factory() as session:
+        hotel_ids = (await session.scalars(select(HotelAttribute.hotel_id).distinct())).all()
+        # Current rows are updated in place when a source sends a new version
+        updated = await session.execute(
+            update(HotelAttribute)
+            .where(HotelAttribute.hotel_id == 'h0000001', HotelAttribute.source == 'acme')
+            .values(attributes={
+                "name": "Renamed", "description": "", "location": {"lat": "x", "lng": 1},
+                "amenities": {"general": [], "room": ["kettle"]}, "images": {}, "booking_conditions": None
+            })
+        )
+        assert updated.rowcount == 1
+        # Unknown sources have priority 0, ties keep the source stored first
+        session.add(HotelAttribute(hotel_id='h0000002', source='other', attributes={
+            "destination_id": 9, "name": "Other", "location": {"lat": 95.0, "lng": 1.0},
+            "amenities": {}, "images": {"site": [{"link": "o.jpg", "description": ""}]}
+        }))
+        await session.commit()
+    hotel_ids += ['h0000002', 'missing']
+
+    async with scraper.session_factory() as session:
+        scraper.merge_backend = 'python'
+        await scraper.data_merging(hotel_ids, chunk_size=128)
+        expected = await merged_hotels(session)
+
+        await session.execute(Hotel.__table__.delete())
+        await session.commit()
+        scraper.merge_backend = 'sql'
+        await scraper.data_merging(hotel_ids, chunk_size=128)
+        merged = await merged_hotels(session)
+
+        assert len(merged) == len(expected) > 250
+        assert merged == expected
+
+        # Re-merging updates the rows in place
+        await scraper.data_merging(hotel_ids, chunk_size=128)
+        assert await merged_hotels(session) == expected
+
+
+@pytest.mark.asyncio
+async def test_sql_merge_matches_python_merge(mock_scraper):
+    """Test the in-database merge writes the same hotels as merge_hotel"""
+    await assert_sql_merge_matches_python_merge(mock_scraper)
+
+
+@pytest.mark.postgres
+@pytest.mark.asyncio
+async def test_postgresql_merge_matches_python_merge(postgres_scraper):
+    """Test the Postgres statement against a real server, skipped unless TEST_POSTGRES_URL is set"""
+    await assert_sql_merge_matches_python_merge(postgres_scraper)
+
+
+def test_postgresql_statement():
+    """Test the Postgres merge is one ordered aggregate per merged field"""
+    statement = postgresql_statement({'acme': 0, 'paperflies': 6})
+    assert statement.count('array_agg(') == 13
+    assert "FILTER (WHERE NOT (a #> '{location,lat}' IS NULL" in statement
+    assert 'ON CONFLICT (id) DO UPDATE SET destination_id = excluded.destination_id' in statement
+
+
+def test_documents_keep_the_merge_key_order(sample_hotel_data):
+    """Test nested objects read back from JSONB (keys shortest first) render the same bytes as the merge"""
+    jsonb_order = dict(
+        sample_hotel_data,
+        location={"lat": 1.0, "lng": 1.0, "city": "Test City", "address": "123 Test St", "country": "Test Country"},
+        amenities={"room": ["tv", "safe"], "general": ["wifi", "parking"]},
+        images={"site": sample_hotel_data["images"]["site"], "rooms": sample_hotel_data["images"]["rooms"],
+                "amenities": []},
+    )
+    assert render_hotel(jsonb_order) == render_hotel(sample_hotel_data)
@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from metrics import SKIPPED_RUNS
+from worker import Worker, parse_intervals
+
+
+class FakeScraper:
+    def __init__(self, sources, duration=0.0):
+        self.sources = {source: f"https://example.com/{source}" for source in sources}
+        self.duration = duration
+        self.runs = []
+        self.merges = 0
+        self.active = 0
+        self.max_active = 0
+        self.compactions = 0
+
+    async def run_source(self, source):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.duration)
+        finally:
+            self.active -= 1
+        self.runs.append(source)
+        return ["h2", "h1"]
+
+    async def schedule_merge(self):
+        self.merges += 1
+
+    async def compact_history(self):
+        self.compactions += 1
+
+
+def test_parse_intervals():
+    """Test per source intervals are read from SCRAPE_INTERVALS"""
+    assert parse_intervals("acme=300, paperflies=60.5,") == {"acme": 300.0, "paperflies": 60.5}
+    assert parse_intervals("") == {}
+
+
+@pytest.mark.asyncio
+async def test_worker_runs_sources_on_their_interval():
+    """Test each source runs on its own cadence and is merged after every run"""
+    scraper = FakeScraper(["fast", "slow"])
+    worker = Worker(scraper, intervals={"fast": 0.02, "slow": 10}, jitter=0)
+    runner = asyncio.create_task(worker.run())
+    await asyncio.sleep(0.11)
+    worker.stop()
+    await asyncio.wait_for(runner, 1)
+
+    # Every source runs once at startup, then on its own interval
+    assert scraper.runs.count("fast") >= 3
+    assert scraper.runs.count("slow") == 1
+    assert scraper.merges == len(scraper.runs)
+    # The history is compacted at startup, then every compact_interval
+    assert scraper.compactions == 1
+
+
+@pytest.mark.asyncio
+async def test_worker_skips_overlapping_runs_and_caps_concurrency():
+    """Test a source still running is skipped and at most `concurrency` sources run at once"""
+    SKIPPED_RUNS.values.clear()
+    scraper = FakeScraper(["a", "b", "c"], duration=0.05)
+    worker = Worker(scraper, intervals={"a": 0.02, "b": 0.02, "c": 0.02}, concurrency=2, jitter=0)
+    runner = asyncio.create_task(worker.run())
+    await asyncio.sleep(0.1)
+    worker.stop()
+    await asyncio.wait_for(runner, 1)
+
+    assert scraper.max_active == 2
+    assert SKIPPED_RUNS.get(source="a") >= 1
+    assert scraper.active == 0  # in-flight runs finish before run() returns
+
+
+@pytest.mark.asyncio
+async def test_worker_cancels_runs_past_the_shutdown_timeout():
+    """Test stop() waits for running sources up to the shutdown timeout"""
+    scraper = FakeScraper(["a"], duration=10)
+    worker = Worker(scraper, intervals={"a": 0.01}, jitter=0, shutdown_timeout=0.05)
+    runner = asyncio.create_task(worker.run())
+    await asyncio.sleep(0.03)
+    worker.stop()
+    await asyncio.wait_for(runner, 1)
+
+    assert scraper.runs == []
+    assert worker.running == set()
@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import socket
+from typing import Dict, Optional, Set
+
+from config import *
+from merge_queue import consume
+from metrics import REGISTRY, SKIPPED_RUNS
+from scraper import Scraper, engine
+
+logger = logging.getLogger(__name__)
+
+
+def parse_intervals(value: str) -> Dict[str, float]:
+    """Parse "acme=300,paperflies=60" into seconds per source"""
+    intervals = {}
+    for entry in filter(None, (entry.strip() for entry in value.split(','))):
+        source, _, seconds = entry.partition('=')
+        intervals[source.strip()] = float(seconds)
+    return intervals
+
+
+class Worker:
+    """Resident scheduler running every source of a Scraper on its own interval"""
+
+    def __init__(
+        self,
+        scraper: Scraper,
+        intervals: Optional[Dict[str, float]] = None,
+        concurrency: int = WORKER_CONCURRENCY,
+        jitter: float = SCRAPE_JITTER,
+        shutdown_timeout: float = WORKER_SHUTDOWN_TIMEOUT,
+        compact_interval: float = HISTORY_COMPACT_INTERVAL
+    ):
+        self.scraper = scraper
+        overrides = parse_intervals(SCRAPE_INTERVALS) if intervals is None else intervals
+        self.intervals = {source: overrides.get(source, SCRAPE_INTERVAL) for source in scraper.sources}
+        self.jitter = jitter
+        self.shutdown_timeout = shutdown_timeout
+        self.compact_interval = compact_interval
+        self.slots = asyncio.Semaphore(concurrency)
+        self.running: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+        self.stopping = asyncio.Event()
+
+    def next_delay(self, source: str) -> float:
+        # Jitter keeps sources sharing an interval from hitting the database at the same moment
+        interval = self.intervals[source]
+        return max(interval * (1 + random.uniform(-self.jitter, self.jitter)), 0)
+
+    async def run_source(self, source: str):
+        """Fetch and ingest one source then merge its changes, skipped while its previous run is still going"""
+        if source in self.running:
+            SKIPPED_RUNS.inc(source=source)
+            logger.warning("%s: previous run still in progress, skipped", source)
+            return
+        self.running.add(source)
+        try:
+            async with self.slots:
+                await self.scraper.run_source(source)
+                # Merges of sources sharing hotels are serialized by Scraper.locked_hotels
+                await self.scraper.schedule_merge()
+        except Exception:
+            logger.exception("%s: run failed", source)
+        finally:
+            self.running.discard(source)
+
+    async def schedule(self, source: str):
+        # The first runs are spread over the jitter window instead of all starting at once
+        delay = random.uniform(0, self.intervals[source] * self.jitter)
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=delay)
+                break
+            except asyncio.TimeoutError:
+                pass
+            # Started on a fixed cadence, a run outliving its interval makes the next one skip
+            task = asyncio.create_task(self.run_source(source))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            delay = self.next_delay(source)
+
+    async def compact(self):
+        """Compact the attribute history every compact_interval, starting with the upcoming partitions at startup"""
+        while not self.stopping.is_set():
+            try:
+                await self.scraper.compact_history()
+            except Exception:
+                logger.exception("History compaction failed")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=self.compact_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        """Schedule every source until stop(), then let in-flight runs finish"""
+        logger.info("Scheduling %s", ', '.join(f'{source} every {interval:g}s' for source, interval in self.intervals.items()))
+        schedules = [self.schedule(source) for source in self.intervals]
+        if self.compact_interval > 0:
+            schedules.append(self.compact())
+        await asyncio.gather(*schedules)
+        if self.tasks:
+            logger.info("Waiting for %d running sources", len(self.tasks))
+            _, pending = await asyncio.wait(set(self.tasks), timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def stop(self):
+        self.stopping.set()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Resident scraper and merge workers')
+    parser.add_argument('mode', nargs='?', choices=['scrape', 'merge'], default='scrape',
+                        help='"scrape" runs the source schedules, "merge" consumes the merge queue (MERGE_QUEUE)')
+    mode = parser.parse_args().mode
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    loop = asyncio.get_running_loop()
+    try:
+        # One Scraper for the lifetime of the process, HTTP connections, DB pool and caches stay warm
+        async with Scraper() as scraper:
+            if mode == 'merge':
+                stopping = asyncio.Event()
+                stop = stopping.set
+                name = f'{socket.gethostname()}-{os.getpid()}'
+                running = asyncio.gather(*[
+                    consume(scraper, f'{name}-{number}', stopping) for number in range(MERGE_WORKERS)
+                ])
+            else:
+                worker = Worker(scraper)
+                stop = worker.stop
+                running = worker.run()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signum, stop)
+            await running
+    finally:
+        await engine.dispose()
+        print(json.dumps(REGISTRY.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())